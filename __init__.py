@@ -1,10 +1,60 @@
-from violet.murcko import murcko
-from violet.murcko_alpha import murcko_alpha
-from violet.reaction import reaction
-from violet.rotatable_bonds import rotatable_bonds
-from violet.sp3carbon import sp3carbon
-from violet.tpsa import tpsa
-from violet.regioisomers import regioisomers
+# Core imports
+import importlib
+import sys
+import types
 
-__all__ = ['murcko', 'murcko_alpha', 'reaction', 'rotatable_bonds', 'sp3carbon', 'tpsa', 'regioisomers']
 
+# The functions that the package exports, and the submodule each is defined
+# in. Submodules are only imported when one of their names is first used, so
+# that importing violet, or one of its submodules, doesn't import the rest.
+_EXPORTS = {
+    'murcko': 'violet.murcko',
+    'murcko_alpha': 'violet.murcko_alpha',
+    'reaction': 'violet.reaction',
+    'rotatable_bonds': 'violet.rotatable_bonds',
+    'sp3carbon': 'violet.sp3carbon',
+    'tpsa': 'violet.tpsa',
+}
+
+# Submodules that can be used as attributes of the package, e.g.
+# violet.descriptors.compute(), without importing them first.
+_SUBMODULES = ('aio', 'arrays', 'batch', 'benchmarks', 'cache', 'cli', 'descriptors', 'failures', 'incremental',
+               'instrument', 'jobs', 'offsets', 'scaffolds', 'session')
+
+__all__ = list(_EXPORTS)
+
+
+class _Package(types.ModuleType):
+    """
+    The violet package. The import system binds each submodule to its
+    package when the submodule is loaded, which would hide the function of
+    the same name; those bindings are skipped, so violet.tpsa is always the
+    tpsa() function, as it was when the package imported every submodule.
+    """
+
+    def __setattr__(self, name, value):
+        if name in _EXPORTS and isinstance(value, types.ModuleType):
+            return
+        super().__setattr__(name, value)
+
+
+def __getattr__(name):
+    """
+    Import the submodule that defines an exported function, or a submodule,
+    when it is first used.
+    """
+    if name in _EXPORTS:
+        value = getattr(importlib.import_module(_EXPORTS[name]), name)
+    elif name in _SUBMODULES:
+        value = importlib.import_module('violet.' + name)
+    else:
+        raise AttributeError("module 'violet' has no attribute %r" % (name))
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS) | set(_SUBMODULES))
+
+
+sys.modules[__name__].__class__ = _Package
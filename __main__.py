@@ -0,0 +1,9 @@
+# Core imports
+import sys
+
+# Violet library imports
+from violet.cli import main
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,203 @@
+# Core imports
+import asyncio
+import concurrent.futures
+import os
+
+# Violet library imports
+from violet.descriptors import compute, resolve
+from violet.session import get as get_session
+from violet.tpsa import default_calculator
+
+
+def _init_worker():
+    """
+    Create the worker's Indigo session and compile the TPSA patterns once.
+    """
+    default_calculator(get_session())
+
+
+def _compute_batch(requests):
+    """
+    Compute the descriptors for a list of (smiles, descriptors) requests in a
+    worker, returning an (ok, values or exception) pair for each.
+    """
+    outcomes = []
+    for smiles, descriptors in requests:
+        try:
+            outcomes.append((True, compute(smiles, descriptors)))
+        except Exception as e:
+            outcomes.append((False, e))
+    return outcomes
+
+
+class DescriptorService(object):
+    """
+    Compute descriptors from asyncio code without blocking the event loop.
+
+    Requests are queued, and a dispatcher sends them to a pool of workers
+    (processes, or threads if processes is False), each with its own Indigo
+    session. The dispatcher waits for a free worker and then takes every
+    queued request, up to max_batch, as one batch, so a single request is
+    sent at once when the service is idle and requests are grouped when it
+    is busy, which keeps the per-request cost of the pool low under load.
+
+    At most max_pending requests can be queued; further calls wait for
+    room, which pushes back on callers. A request that times out or is
+    cancelled while queued is dropped; one that is already being computed
+    runs to completion but its result is discarded.
+
+        async with DescriptorService() as service:
+            value = await service.tpsa("CNCc1ccccc1")
+    """
+
+    def __init__(self, workers=None, processes=True, max_batch=64, max_pending=10000, timeout=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.processes = processes
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._executor = None
+        self._queue = None
+        self._slots = None
+        self._dispatcher = None
+        self._batches = set()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def start(self):
+        """
+        Start the worker pool and the dispatcher. Called by the first
+        request if need be.
+        """
+        if self._dispatcher is not None:
+            return
+        if self.processes:
+            self._executor = concurrent.futures.ProcessPoolExecutor(self.workers, initializer=_init_worker)
+        else:
+            self._executor = concurrent.futures.ThreadPoolExecutor(self.workers, initializer=_init_worker)
+        self._queue = asyncio.Queue(self.max_pending)
+        self._slots = asyncio.Semaphore(self.workers)
+        self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+
+    async def close(self):
+        """
+        Stop the dispatcher, cancel queued requests, including one the
+        dispatcher was holding for a free worker, wait for batches that are
+        being computed and shut down the workers.
+        """
+        if self._dispatcher is None:
+            return
+        self._dispatcher.cancel()
+        try:
+            await self._dispatcher
+        except asyncio.CancelledError:
+            pass
+        while not self._queue.empty():
+            self._queue.get_nowait()[2].cancel()
+        if self._batches:
+            await asyncio.gather(*self._batches, return_exceptions=True)
+        self._executor.shutdown(wait=True)
+        self._dispatcher = None
+
+    async def _dispatch(self):
+        """
+        Send batches of queued requests to free workers.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            # Requests pile up in the queue while every worker is busy.
+            try:
+                await self._slots.acquire()
+            except asyncio.CancelledError:
+                # close() cancelled the dispatcher while it held a request.
+                batch[0][2].cancel()
+                raise
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            batch = [request for request in batch if not request[2].done()]
+            if not batch:
+                self._slots.release()
+                continue
+            task = loop.create_task(self._run_batch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _run_batch(self, batch):
+        """
+        Compute one batch in a worker and resolve the futures of its
+        requests.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            requests = [(smiles, descriptors) for smiles, descriptors, _ in batch]
+            outcomes = await loop.run_in_executor(self._executor, _compute_batch, requests)
+            for (_, _, future), (ok, value) in zip(batch, outcomes):
+                if future.done():
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._slots.release()
+
+    async def compute(self, smiles, descriptors=None, timeout=None):
+        """
+        Return an ordered dictionary of descriptor values for a SMILES
+        string, as violet.descriptors.compute() does. Raises the exception
+        that computing them raised, or asyncio.TimeoutError if the values
+        aren't ready within timeout seconds (by default the service's
+        timeout).
+        """
+        await self.start()
+        descriptors = resolve(descriptors)
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((smiles, descriptors, future))
+        timeout = timeout if timeout is not None else self.timeout
+        if timeout is None:
+            return await future
+        return await asyncio.wait_for(future, timeout)
+
+    async def compute_many(self, smiles_list, descriptors=None, timeout=None):
+        """
+        Compute descriptors for a list of SMILES strings concurrently and
+        return a list holding the values, or the exception raised, for each.
+        """
+        return await asyncio.gather(*[self.compute(smiles, descriptors, timeout) for smiles in smiles_list],
+                                    return_exceptions=True)
+
+    async def tpsa(self, smiles, timeout=None):
+        """
+        Return the topological polar surface area of a SMILES string.
+        """
+        return (await self.compute(smiles, ['tpsa'], timeout))['tpsa']
+
+    async def rotatable_bonds(self, smiles, timeout=None):
+        """
+        Return the number of rotatable bonds of a SMILES string.
+        """
+        return (await self.compute(smiles, ['rotatable_bonds'], timeout))['rotatable_bonds']
+
+    async def sp3carbon(self, smiles, timeout=None):
+        """
+        Return the (carbon, sp3 carbon, sp3 fraction) tuple of a SMILES
+        string.
+        """
+        return (await self.compute(smiles, ['sp3carbon'], timeout))['sp3carbon']
+
+    async def murcko(self, smiles, timeout=None):
+        """
+        Return the canonical SMILES of the Murcko framework of a SMILES
+        string, or None if it has no ring.
+        """
+        return (await self.compute(smiles, ['murcko'], timeout))['murcko']
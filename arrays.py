@@ -0,0 +1,116 @@
+# Third-party module imports
+import numpy
+from numpy.lib.format import open_memmap
+
+# Violet library imports
+from violet.batch import Failure, run
+from violet.descriptors import columns, flatten, resolve
+from violet.scaffolds import scaffold_key
+
+
+# The NumPy type of each descriptor column. Scaffolds, which are SMILES
+# strings elsewhere, are stored as their 64 bit scaffold_key(), with the
+# key of '' for molecules that have no scaffold. Columns not listed here
+# are stored as floats.
+COLUMN_TYPES = {
+    'tpsa': 'f8',
+    'rotatable_bonds': 'i4',
+    'num_carbon': 'i4',
+    'num_carbon_sp3': 'i4',
+    'sp3_fraction': 'f8',
+    'murcko': 'i8',
+    'murcko_alpha': 'i8',
+}
+
+# Columns stored as scaffold keys.
+KEY_COLUMNS = ('murcko', 'murcko_alpha')
+
+# The value of each type of column in rows that aren't valid.
+FILL_VALUES = {'f': numpy.nan, 'i': -1}
+
+
+def dtype(descriptors=None):
+    """
+    Return the NumPy structured dtype of a results array: a 'valid' flag,
+    which is False for molecules that couldn't be processed, and one field
+    per descriptor column.
+    """
+    fields = [('valid', '?')]
+    for name in columns(resolve(descriptors)):
+        fields.append((name, COLUMN_TYPES.get(name, 'f8')))
+    return numpy.dtype(fields)
+
+
+def allocate(count, descriptors=None, path=None):
+    """
+    Return a results array for count molecules, with every row invalid. If
+    a path is given the array is a memory-mapped .npy file, created or
+    overwritten, that numpy.load(path, mmap_mode='r') can open later.
+    """
+    array_dtype = dtype(descriptors)
+    if path is None:
+        out = numpy.empty(count, dtype=array_dtype)
+    else:
+        out = open_memmap(path, mode='w+', dtype=array_dtype, shape=(count,))
+    out['valid'] = False
+    for name in array_dtype.names[1:]:
+        out[name] = FILL_VALUES.get(array_dtype[name].kind, 0)
+    return out
+
+
+def _bounded(molecules, rows):
+    """
+    Generate the items of an iterable, raising ValueError if there are more
+    than rows of them.
+    """
+    for n, item in enumerate(molecules):
+        if n == rows:
+            raise ValueError("There are more molecules than the %d rows left in the results array." % (rows))
+        yield item
+
+
+def fill(out, molecules, descriptors=None, jobs=1, chunk_size=1000, start=0):
+    """
+    Compute descriptors for molecules, as batch.run() does, writing the
+    values of the n-th molecule into row start + n of a results array made
+    by allocate() for the same descriptors. Returns the list of Failures;
+    their rows are left invalid. Raises ValueError, as soon as the input is
+    read that far, if there are more molecules than rows from start.
+    """
+    descriptors = resolve(descriptors)
+    names = columns(descriptors)
+    keys = [i for i, name in enumerate(names) if name in KEY_COLUMNS]
+    failures = []
+    molecules = _bounded(molecules, len(out) - start)
+    for outcome in run(molecules, descriptors, jobs, chunk_size, ordered=False):
+        if isinstance(outcome, Failure):
+            failures.append(outcome)
+            continue
+        values = flatten(outcome.values)
+        for i in keys:
+            values[i] = scaffold_key(values[i] or '')
+        out[start + outcome.index] = tuple([True] + values)
+    return failures
+
+
+def compute_array(molecules, descriptors=None, jobs=1, chunk_size=1000, path=None, count=None):
+    """
+    Compute descriptors for SMILES strings, or (id, smiles) pairs, into a
+    new results array, in memory or memory-mapped at path. Returns an
+    (array, failures) pair.
+
+    The array is allocated up front for count molecules, or len(molecules)
+    if count isn't given; an iterable without a length is read into a list
+    first. Raises ValueError if there are more molecules than count.
+    """
+    if count is None:
+        if not hasattr(molecules, '__len__'):
+            molecules = list(molecules)
+        count = len(molecules)
+    elif hasattr(molecules, '__len__') and len(molecules) > count:
+        raise ValueError("There are %d molecules, more than the count of %d." % (len(molecules), count))
+    out = allocate(count, descriptors, path)
+    failures = fill(out, molecules, descriptors, jobs, chunk_size)
+    if path is not None:
+        out.flush()
+    return out, failures
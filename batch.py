@@ -0,0 +1,177 @@
+# Core imports
+import collections
+import concurrent.futures
+import itertools
+import os
+
+# Violet library imports
+from violet import instrument
+from violet.cache import DescriptorCache
+from violet.descriptors import compute, resolve
+from violet.failures import Failure, from_exception
+from violet.session import get as get_session
+from violet.tpsa import default_calculator
+
+
+# The outcome for one input molecule. Index is its position in the input.
+# Molecules that fail are reported as violet.failures.Failures. When
+# computing against previous results, key is the (structure key, input key)
+# pair of the molecule (see violet.incremental), and molecules whose
+# previous values can be reused are Unchanged.
+Result = collections.namedtuple("Result", ["index", "id", "values", "key"], defaults=[None])
+Unchanged = collections.namedtuple("Unchanged", ["index", "id", "key"])
+
+# State of a worker process, set by _init_worker().
+_worker_indigo = None
+_worker_descriptors = None
+_worker_cache = None
+_worker_previous = None
+
+
+def _init_worker(descriptors, cache_size=0, cache_path=None, instrumented=False, previous=None):
+    """
+    Create the Indigo session, compile the TPSA patterns if needed and open
+    the descriptor cache if one is used, once per worker process.
+    Instrumentation is enabled in the worker if it is in the parent.
+    """
+    global _worker_indigo, _worker_descriptors, _worker_cache, _worker_previous
+    if instrumented:
+        instrument.enable()
+    _worker_indigo = get_session()
+    _worker_descriptors = descriptors
+    if 'tpsa' in descriptors:
+        default_calculator(_worker_indigo)
+    _worker_cache = None
+    if cache_size or cache_path:
+        _worker_cache = DescriptorCache(cache_size, cache_path)
+    _worker_previous = previous
+
+
+def _run_chunk(chunk):
+    """
+    Compute the descriptors for a list of (index, id, smiles) tuples in a
+    worker process.
+    """
+    outcomes = []
+    compute_values = _worker_cache.compute if _worker_cache else compute
+    for index, mol_id, smiles in chunk:
+        instrument.count('molecules')
+        try:
+            if _worker_previous is not None:
+                key, values = _worker_previous.compute(smiles, _worker_descriptors, _worker_indigo)
+                if values is None:
+                    outcomes.append(Unchanged(index, mol_id, key))
+                else:
+                    outcomes.append(Result(index, mol_id, values, key))
+                continue
+            values = compute_values(smiles, _worker_descriptors, _worker_indigo)
+            outcomes.append(Result(index, mol_id, values))
+        except Exception as e:
+            instrument.count('failures')
+            outcomes.append(from_exception(index, mol_id, smiles, e))
+    # Worker processes aren't told when they are about to exit, so commit
+    # cached values after each chunk.
+    if _worker_cache and _worker_cache.persistent:
+        _worker_cache.persistent.flush()
+    return outcomes
+
+
+def _chunks(molecules, chunk_size):
+    """
+    Split an iterable of SMILES strings or (id, smiles) pairs into lists of
+    (index, id, smiles) tuples. Plain SMILES strings are given their index
+    as an ID.
+    """
+    numbered = enumerate(molecules)
+    while True:
+        chunk = []
+        for index, item in itertools.islice(numbered, chunk_size):
+            if isinstance(item, str):
+                chunk.append((index, index, item))
+            else:
+                chunk.append((index, item[0], item[1]))
+        if not chunk:
+            return
+        yield chunk
+
+
+def run(molecules, descriptors=None, jobs=None, chunk_size=1000, ordered=True, cache_size=0, cache_path=None,
+        previous=None):
+    """
+    Compute descriptors for an iterable of SMILES strings or (id, smiles)
+    pairs across a pool of worker processes, generating a Result or Failure
+    for each molecule.
+
+    Input is read lazily and sent to the workers in chunks of chunk_size
+    molecules, with at most two chunks per worker in flight, so memory use
+    doesn't grow with the size of the input. With ordered=False, outcomes
+    are generated as soon as their chunk finishes. jobs defaults to the
+    number of CPUs; with jobs=1 everything runs in this process.
+
+    With a cache_size, each worker memoizes up to that many descriptor
+    values, and with a cache_path the workers share a persistent SQLite
+    cache; see violet.cache.DescriptorCache.
+
+    With previous, a violet.incremental.PreviousResults, molecules whose
+    values it holds are generated as Unchanged rather than computed, and
+    Results carry their keys. It can't be combined with a cache.
+    """
+    global _worker_cache, _worker_previous
+    descriptors = resolve(descriptors)
+    if previous is not None and (cache_size or cache_path):
+        raise ValueError("Previous results can't be combined with a descriptor cache.")
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    chunks = _chunks(molecules, chunk_size)
+
+    if jobs == 1:
+        _init_worker(descriptors, cache_size, cache_path, instrument.enabled, previous)
+        try:
+            for chunk in chunks:
+                for outcome in _run_chunk(chunk):
+                    yield outcome
+        finally:
+            if _worker_cache:
+                _worker_cache.close()
+            _worker_cache = None
+            _worker_previous = None
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(jobs, initializer=_init_worker,
+                                                initargs=(descriptors, cache_size, cache_path, instrument.enabled,
+                                                          previous)) as executor:
+        pending = collections.deque()
+        for chunk in itertools.chain(chunks, [None]):
+            if chunk is not None:
+                pending.append(executor.submit(instrument.measured, _run_chunk, chunk))
+                if len(pending) < 2*jobs:
+                    continue
+            # Wait for work to finish before reading more input, or until
+            # everything has finished at the end of the input.
+            while pending and (chunk is None or len(pending) >= 2*jobs):
+                if ordered:
+                    done = pending.popleft()
+                else:
+                    finished, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    done = finished.pop()
+                    pending.remove(done)
+                outcomes, stats = done.result()
+                if stats:
+                    instrument.merge(stats)
+                for outcome in outcomes:
+                    yield outcome
+
+
+def collect(molecules, descriptors=None, jobs=None, chunk_size=1000, ordered=True, cache_size=0, cache_path=None):
+    """
+    Run run() to completion and return a (results, failures) pair of lists.
+    """
+    results = []
+    failures = []
+    for outcome in run(molecules, descriptors, jobs, chunk_size, ordered, cache_size, cache_path):
+        if isinstance(outcome, Failure):
+            failures.append(outcome)
+        else:
+            results.append(outcome)
+    return results, failures
+
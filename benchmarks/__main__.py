@@ -0,0 +1,77 @@
+# Core imports
+import argparse
+import json
+import sys
+
+# Violet library imports
+from violet.benchmarks import corpus
+from violet.benchmarks.suite import BENCHMARKS, compare, report, run
+
+
+def parse_args(argv):
+    """
+    Parse the command line arguments.
+    """
+    parser = argparse.ArgumentParser(prog='python -m violet.benchmarks',
+                                     description='Benchmark violet functions over a fixed corpus of molecules.')
+    parser.add_argument('-b', '--benchmarks', default=','.join(BENCHMARKS),
+                        help='comma-separated benchmarks to run (default: %(default)s)')
+    parser.add_argument('-c', '--corpus', default=corpus.CORPUS_FILE,
+                        help='SMILES file of molecules to run over (default: the bundled corpus)')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='passes over the corpus (default: %(default)s)')
+    parser.add_argument('-o', '--output',
+                        help='file to write the results to as JSON')
+    parser.add_argument('--results',
+                        help='compare previously saved results instead of running the benchmarks')
+    parser.add_argument('--baseline',
+                        help='saved results to check for regressions against')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='fraction by which a metric may be worse than the baseline (default: %(default)s)')
+    parser.add_argument('--imports', action='store_true',
+                        help='also measure how long importing the package and its submodules takes')
+    parser.add_argument('--no-isolate', action='store_true',
+                        help='run every benchmark in this process rather than a fresh one each')
+    args = parser.parse_args(argv)
+    args.benchmarks = [name.strip() for name in args.benchmarks.split(',') if name.strip()]
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark: %s" % (name))
+    return args
+
+
+def main(argv=None):
+    """
+    Run the benchmarks, or load saved results, report them and check them
+    against a baseline. Returns 1 if there are regressions.
+    """
+    args = parse_args(argv)
+    if args.results:
+        with open(args.results) as fh:
+            results = json.load(fh)
+    else:
+        results = run(args.benchmarks, corpus.load(args.corpus), args.repeat, not args.no_isolate,
+                      args.imports)
+    report(results)
+
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+        if baseline['meta']['corpus'] != results['meta']['corpus']:
+            sys.stderr.write("warning: the baseline was measured on a different corpus\n")
+        regressions = compare(baseline, results, args.threshold)
+        for r in regressions:
+            sys.stdout.write("REGRESSION %s %s: %.1f -> %.1f (%+.0f%%)\n" % (
+                r.benchmark, r.metric, r.baseline, r.current, 100 * r.change))
+        if regressions:
+            return 1
+        sys.stdout.write("No regressions against %s\n" % (args.baseline))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,174 @@
+# Core imports
+import hashlib
+import os
+import sys
+
+
+# The bundled corpus, written by running this module.
+CORPUS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus.smi')
+
+# Marketed drugs and other small drug-like molecules.
+DRUGS = [
+    ("aspirin", "CC(=O)Oc1ccccc1C(=O)O"),
+    ("caffeine", "Cn1cnc2c1c(=O)n(C)c(=O)n2C"),
+    ("ibuprofen", "CC(C)Cc1ccc(cc1)C(C)C(=O)O"),
+    ("paracetamol", "CC(=O)Nc1ccc(O)cc1"),
+    ("diazepam", "CN1C(=O)CN=C(c2ccccc2)c2cc(Cl)ccc12"),
+    ("nicotine", "CN1CCC[C@H]1c1cccnc1"),
+    ("atenolol", "CC(C)NCC(O)COc1ccc(CC(N)=O)cc1"),
+    ("ciprofloxacin", "OC(=O)C1=CN(C2CC2)c2cc(N3CCNCC3)c(F)cc2C1=O"),
+    ("sildenafil", "CCCc1nn(C)c2c1nc([nH]c2=O)-c1cc(ccc1OCC)S(=O)(=O)N1CCN(C)CC1"),
+    ("imatinib", "Cc1ccc(NC(=O)c2ccc(CN3CCN(C)CC3)cc2)cc1Nc1nccc(n1)-c1cccnc1"),
+    ("atorvastatin", "CC(C)c1c(C(=O)Nc2ccccc2)c(-c2ccccc2)c(-c2ccc(F)cc2)n1CC[C@@H](O)C[C@@H](O)CC(=O)O"),
+    ("morphine", "CN1CC[C@]23[C@@H]4Oc5c(O)ccc(C[C@@H]1[C@@H]2C=C[C@@H]4O)c35"),
+    ("penicillin_g", "CC1(C)S[C@@H]2[C@H](NC(=O)Cc3ccccc3)C(=O)N2[C@H]1C(=O)O"),
+    ("testosterone", "C[C@]12CC[C@H]3[C@@H](CCC4=CC(=O)CC[C@]34C)[C@@H]1CC[C@@H]2O"),
+    ("metformin", "CN(C)C(=N)NC(N)=N"),
+    ("omeprazole", "COc1ccc2[nH]c(nc2c1)S(=O)Cc1ncc(C)c(OC)c1C"),
+    ("losartan", "CCCCc1nc(Cl)c(CO)n1Cc1ccc(cc1)-c1ccccc1-c1nn[nH]n1"),
+    ("fluoxetine", "CNCCC(Oc1ccc(cc1)C(F)(F)F)c1ccccc1"),
+    ("warfarin", "CC(=O)CC(c1ccccc1)C1=C(O)c2ccccc2OC1=O"),
+    ("quinine", "COc1ccc2nccc([C@@H](O)[C@@H]3C[C@@H]4CCN3C[C@@H]4C=C)c2c1"),
+]
+
+# Ring systems with one attachment point, marked {}, and substituents whose
+# first atom bonds to the ring system.
+CORES = [
+    "c1ccc({})cc1", "c1ccnc({})c1", "c1ccc2[nH]c({})cc2c1", "c1csc({})c1",
+    "C1CCNC({})C1", "C1COCCN1{}", "c1ccc2c(c1)ccc({})n2", "C1CC2CCC1C2{}",
+    "O=C1NC(=O)C({})N1", "c1ccc2c(c1)C(=O)N({})C2=O",
+]
+SUBSTITUENTS = [
+    "C", "O", "N", "Cl", "F", "C#N", "C(=O)O", "C(=O)N", "NC(=O)C", "N(C)C",
+    "S(=O)(=O)N", "OC(=O)C", "C(F)(F)F", "CC(=O)NC9CC9", "c9ccncc9",
+    "C(=O)Nc9ccc(Cl)cc9", "CN9CCN(C)CC9", "OCCN9CCOCC9",
+]
+
+
+def druglike():
+    """
+    Generate (id, smiles) pairs for drugs, and for each ring system with
+    each substituent.
+    """
+    for name, smiles in DRUGS:
+        yield name, smiles
+    for i, core in enumerate(CORES):
+        for j, substituent in enumerate(SUBSTITUENTS):
+            yield "druglike_%d_%d" % (i, j), core.format(substituent)
+
+
+def macrocycles():
+    """
+    Generate (id, smiles) pairs for carbocyclic, crown ether, lactam and
+    cyclic peptide macrocycles of increasing size, bare and substituted.
+    """
+    for size in range(12, 41, 4):
+        yield "cycloalkane_%d" % (size), "C1" + "C" * (size - 1) + "1"
+        yield "cycloalkane_sub_%d" % (size), "C1" + "C(C)" * 3 + "C(O)" * 2 + "C" * (size - 6) + "1"
+        yield "lactam_%d" % (size), "O=C1NCC" + "C" * (size - 5) + "C1"
+        yield "macrolide_%d" % (size), "O=C1OC(C)C" + "C(O)C" * ((size - 4) // 2) + "1"
+    for units in range(4, 11):
+        yield "crown_%d" % (units), "C1CO" + "CCO" * (units - 1) + "C1"
+    # Cyclic peptides of glycine, alanine, serine and phenylalanine.
+    residues = ["NCC(=O)", "NC(C)C(=O)", "NC(CO)C(=O)", "NC(Cc9ccccc9)C(=O)"]
+    for length in range(4, 13, 2):
+        body = "".join(residues[k % len(residues)] for k in range(length))
+        yield "cyclopeptide_%d" % (length), "N1" + body[1:-len("C(=O)")] + "C1=O"
+
+
+def chains():
+    """
+    Generate (id, smiles) pairs for long alkyl, ether, amine, fatty acid and
+    polyene chains, and chains carrying rings at both ends.
+    """
+    for length in range(8, 97, 8):
+        yield "alkane_%d" % (length), "C" * length
+        yield "peg_%d" % (length), "C" + "OCC" * (length // 3) + "O"
+        yield "fatty_acid_%d" % (length), "C" * (length - 1) + "C(=O)O"
+        yield "polyene_%d" % (length), "C" + "C=C" * (length // 2) + "C"
+        yield "branched_%d" % (length), "CC(C)" * (length // 3) + "C"
+        yield "dumbbell_%d" % (length), "c1ccccc1" + "C" * length + "c1ccncc1"
+    # Reacting every amine of a polyamine takes time that grows steeply with
+    # its length (17 seconds at 96 atoms), so these chains are kept shorter.
+    for length in range(8, 49, 8):
+        yield "polyamine_%d" % (length), "N" + "CCN" * (length // 3)
+
+
+def charged():
+    """
+    Generate (id, smiles) pairs for ions, zwitterions and salts.
+    """
+    ions = [
+        ("acetate", "CC(=O)[O-]"),
+        ("tetramethylammonium", "C[N+](C)(C)C"),
+        ("choline", "C[N+](C)(C)CCO"),
+        ("glycine_zwitterion", "[NH3+]CC(=O)[O-]"),
+        ("betaine", "C[N+](C)(C)CC(=O)[O-]"),
+        ("pyridinium", "C[n+]1ccccc1"),
+        ("nitrobenzene", "O=[N+]([O-])c1ccccc1"),
+        ("pyridine_n_oxide", "[O-][n+]1ccccc1"),
+        ("phosphate", "OP(=O)([O-])[O-]"),
+        ("sulfonate", "CCCCCCCCCCCCS(=O)(=O)[O-]"),
+        ("guanidinium", "NC(=[NH2+])N"),
+        ("imidazolium", "CCn1cc[n+](C)c1"),
+        ("phenolate", "[O-]c1ccccc1"),
+        ("azide", "CN=[N+]=[N-]"),
+        ("tetraphenylphosphonium", "c1ccc(cc1)[P+](c1ccccc1)(c1ccccc1)c1ccccc1"),
+    ]
+    counterions = ["[Na+]", "[K+]", "[Cl-]", "[Br-]", "[Ca+2]"]
+    for name, smiles in ions:
+        yield name, smiles
+    salts = [
+        ("sodium_benzoate", "[O-]C(=O)c1ccccc1"),
+        ("potassium_sorbate", "CC=CC=CC(=O)[O-]"),
+        ("metformin_hcl", "CN(C)C(=N)NC(N)=[NH2+]"),
+        ("fluoxetine_hcl", "C[NH2+]CCC(Oc1ccc(cc1)C(F)(F)F)c1ccccc1"),
+        ("atenolol_hcl", "CC(C)[NH2+]CC(O)COc1ccc(CC(N)=O)cc1"),
+    ]
+    for name, smiles in salts:
+        for counterion in counterions:
+            yield "%s_%s" % (name, counterion.strip("[]").replace("+", "p").replace("-", "m")), \
+                "%s.%s" % (smiles, counterion)
+
+
+# The sections of the corpus, in order.
+SECTIONS = [('druglike', druglike), ('macrocycles', macrocycles), ('chains', chains), ('charged', charged)]
+
+
+def generate():
+    """
+    Generate the (id, smiles) pairs of the corpus. The corpus is fixed: it
+    depends on nothing but this module.
+    """
+    for _, section in SECTIONS:
+        for pair in section():
+            yield pair
+
+
+def load(fn=CORPUS_FILE):
+    """
+    Return the list of (id, smiles) pairs in a corpus file.
+    """
+    pairs = []
+    with open(fn) as smi:
+        for line in smi:
+            fields = line.split()
+            if fields:
+                pairs.append((fields[1], fields[0]))
+    return pairs
+
+
+def checksum(pairs):
+    """
+    Return a SHA-256 hex digest of a corpus, so that benchmark results can
+    be checked to come from the same molecules.
+    """
+    digest = hashlib.sha256()
+    for mol_id, smiles in pairs:
+        digest.update(("%s %s\n" % (smiles, mol_id)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+if __name__ == '__main__':
+    for mol_id, smiles in generate():
+        sys.stdout.write("%s %s\n" % (smiles, mol_id))
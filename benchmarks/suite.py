@@ -0,0 +1,243 @@
+# Core imports
+import collections
+import concurrent.futures
+import contextlib
+import datetime
+import io
+import logging
+import multiprocessing
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+# Third-party module imports
+import indigo as indigo_module
+
+# Violet library imports
+from violet.benchmarks import corpus
+from violet.murcko import murcko
+from violet.murcko_alpha import murcko_alpha
+from violet.reaction import reaction
+from violet.rotatable_bonds import rotatable_bonds
+from violet.session import get as get_session
+from violet.sp3carbon import sp3carbon
+from violet.tpsa import tpsa
+
+
+# Amide formation between a corpus molecule, where it has an amine, and
+# acetyl chloride.
+AMIDE_FORMATION_SMARTS = "([NX3;H1,H2;!$(NC=O);!$(NS(=O)=O)]).([CX3;$([R0][#6]),$([H1R0])](=[OX1])[$([OX2H]),$([OX1-]),Cl])>>[NX3;H1;!$(NC=O);!$(NS(=O)=O)][CX3;$([R0][#6]),$([H1R0])](=[OX1])"
+ACYL_CHLORIDE = "CC(=O)Cl"
+
+# A benchmark calls function once per corpus molecule, with the argument
+# that prepare() makes from its SMILES string. Preparation isn't timed.
+Benchmark = collections.namedtuple("Benchmark", ["name", "prepare", "function"])
+
+
+def _smiles(smiles):
+    return smiles
+
+
+def _molecule(smiles):
+    return get_session().loadMolecule(smiles)
+
+
+def _amidation(smiles):
+    return reaction(AMIDE_FORMATION_SMARTS, smiles, ACYL_CHLORIDE)
+
+
+BENCHMARKS = collections.OrderedDict((benchmark.name, benchmark) for benchmark in [
+    Benchmark('tpsa', _smiles, tpsa),
+    Benchmark('rotatable_bonds', _smiles, rotatable_bonds),
+    Benchmark('sp3carbon', _smiles, sp3carbon),
+    Benchmark('murcko', _molecule, murcko),
+    Benchmark('murcko_alpha', _molecule, murcko_alpha),
+    Benchmark('reaction', _smiles, _amidation),
+])
+
+# Statements whose import time import_times() measures, from a bare
+# package import to everything the command line interface needs.
+IMPORTS = collections.OrderedDict([
+    ('violet', 'import violet'),
+    ('tpsa', 'from violet import tpsa'),
+    ('batch', 'import violet.batch'),
+    ('cli', 'import violet.cli'),
+])
+
+# The metrics that compare() checks, and whether a larger value is better.
+# Tail percentiles are recorded, but are too noisy to check.
+COMPARED_METRICS = [('p50_us', False), ('p90_us', False), ('throughput', True), ('peak_rss_kb', False)]
+
+# A metric that is worse than its baseline by more than a fraction.
+Regression = collections.namedtuple("Regression", ["benchmark", "metric", "baseline", "current", "change"])
+
+
+def percentile(values, q):
+    """
+    Return the q-th percentile (0 to 100) of a sorted list, by the nearest
+    rank method.
+    """
+    if not values:
+        return None
+    rank = max(1, -(-len(values) * q // 100))
+    return values[int(rank) - 1]
+
+
+def measure(name, pairs, repeat=3, warmup=10):
+    """
+    Run one benchmark over a list of (id, smiles) pairs repeat times, after
+    warmup untimed calls, and return a dictionary of its latency
+    percentiles in microseconds, throughput in molecules per second, error
+    count and peak resident memory in kilobytes.
+
+    Errors that violet functions log or print are silenced, so that only
+    the functions themselves are timed.
+    """
+    benchmark = BENCHMARKS[name]
+    arguments = [benchmark.prepare(smiles) for _, smiles in pairs]
+    function = benchmark.function
+    latencies = []
+    errors = 0
+    clock = time.perf_counter_ns
+
+    logging.disable(logging.CRITICAL)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            for argument in arguments[:warmup]:
+                try:
+                    function(argument)
+                except Exception:
+                    pass
+            for _ in range(repeat):
+                for argument in arguments:
+                    start = clock()
+                    try:
+                        function(argument)
+                    except Exception:
+                        errors += 1
+                    latencies.append(clock() - start)
+    finally:
+        logging.disable(logging.NOTSET)
+
+    total = sum(latencies)
+    latencies.sort()
+    return collections.OrderedDict([
+        ('molecules', len(pairs)),
+        ('calls', len(latencies)),
+        ('errors', errors),
+        ('total_s', total / 1e9),
+        ('throughput', len(latencies) / (total / 1e9) if total else None),
+        ('mean_us', total / len(latencies) / 1e3 if latencies else None),
+        ('p50_us', percentile(latencies, 50) / 1e3 if latencies else None),
+        ('p90_us', percentile(latencies, 90) / 1e3 if latencies else None),
+        ('p99_us', percentile(latencies, 99) / 1e3 if latencies else None),
+        ('max_us', latencies[-1] / 1e3 if latencies else None),
+        # ru_maxrss is in kilobytes on Linux.
+        ('peak_rss_kb', resource.getrusage(resource.RUSAGE_SELF).ru_maxrss),
+    ])
+
+
+def import_time(statement, repeat=5):
+    """
+    Return the shortest time in milliseconds, over repeat fresh
+    interpreters, that a statement takes to run, less the time that
+    starting the interpreter takes.
+    """
+    def best(code):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.check_call([sys.executable, '-c', code])
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    return (best(statement) - best('pass')) * 1e3
+
+
+def import_times(repeat=5):
+    """
+    Return a dictionary of the import time in milliseconds of each of the
+    IMPORTS.
+    """
+    return collections.OrderedDict((name, import_time(statement, repeat)) for name, statement in IMPORTS.items())
+
+
+def run(names=None, pairs=None, repeat=3, isolate=True, imports=False):
+    """
+    Run benchmarks, by default all of them over the bundled corpus, and
+    return a dictionary of their results and of the environment they ran
+    in, which can be saved as JSON. With imports=True the import times are
+    measured too.
+
+    With isolate=True each benchmark runs in a freshly started process, so
+    that its peak memory isn't inflated by the benchmarks before it.
+    """
+    if names is None:
+        names = list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            raise ValueError("Unknown benchmark: %s" % (name))
+    if pairs is None:
+        pairs = corpus.load()
+
+    results = collections.OrderedDict()
+    for name in names:
+        if isolate:
+            context = multiprocessing.get_context('spawn')
+            with concurrent.futures.ProcessPoolExecutor(1, mp_context=context) as executor:
+                results[name] = executor.submit(measure, name, pairs, repeat).result()
+        else:
+            results[name] = measure(name, pairs, repeat)
+
+    output = collections.OrderedDict([
+        ('meta', collections.OrderedDict([
+            ('date', datetime.datetime.now().isoformat(timespec='seconds')),
+            ('python', platform.python_version()),
+            ('platform', platform.platform()),
+            ('indigo', indigo_module.Indigo().version()),
+            ('corpus', corpus.checksum(pairs)),
+            ('repeat', repeat),
+            ('isolated', isolate),
+        ])),
+        ('benchmarks', results),
+    ])
+    if imports:
+        output['imports'] = import_times()
+    return output
+
+
+def compare(baseline, current, threshold=0.1):
+    """
+    Return the list of Regressions of current results against baseline
+    results: metrics that are more than threshold (a fraction) worse.
+    Benchmarks missing from either set of results are skipped.
+    """
+    regressions = []
+    for name, result in current['benchmarks'].items():
+        if name not in baseline['benchmarks']:
+            continue
+        base = baseline['benchmarks'][name]
+        for metric, larger_is_better in COMPARED_METRICS:
+            if not base.get(metric) or result.get(metric) is None:
+                continue
+            change = (result[metric] - base[metric]) / base[metric]
+            if (-change if larger_is_better else change) > threshold:
+                regressions.append(Regression(name, metric, base[metric], result[metric], change))
+    return regressions
+
+
+def report(results, stream=None):
+    """
+    Write a table of results.
+    """
+    stream = stream or sys.stdout
+    stream.write("%-16s %8s %10s %10s %10s %10s %12s %10s\n" % (
+        'benchmark', 'calls', 'p50_us', 'p90_us', 'p99_us', 'max_us', 'mol/s', 'rss_kb'))
+    for name, result in results['benchmarks'].items():
+        stream.write("%-16s %8d %10.1f %10.1f %10.1f %10.1f %12.1f %10d\n" % (
+            name, result['calls'], result['p50_us'], result['p90_us'], result['p99_us'],
+            result['max_us'], result['throughput'], result['peak_rss_kb']))
+    for name, milliseconds in results.get('imports', {}).items():
+        stream.write("import %-9s %10.1f ms\n" % (name, milliseconds))
@@ -0,0 +1,201 @@
+# Core imports
+import collections
+import json
+import sqlite3
+
+# Violet library imports
+from violet.descriptors import PreparedMolecule, REGISTRY, load_molecule, resolve
+from violet.session import resolve_session
+
+
+# Marks a value that isn't in a cache, since None is a valid value.
+MISSING = object()
+
+
+class LRUCache(object):
+    """
+    An in-process least recently used cache holding at most maxsize
+    entries, which counts hits, misses and evictions.
+    """
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=MISSING):
+        """
+        Return the value for a key, or default if it isn't cached.
+        """
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """
+        Cache a value, evicting the least recently used entry if the cache
+        is full.
+        """
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        """
+        Return a dictionary of the cache size and its hit, miss and eviction
+        counts.
+        """
+        return {'size': len(self.entries), 'maxsize': self.maxsize, 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions}
+
+
+class SQLiteCache(object):
+    """
+    A persistent cache of descriptor values in an SQLite database, keyed by
+    canonical SMILES, descriptor name and descriptor version. Values are
+    stored as JSON. Writes are committed every commit_every values and by
+    flush() or close().
+    """
+
+    def __init__(self, path, commit_every=1000):
+        self.path = path
+        self.commit_every = commit_every
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS descriptors (smiles TEXT, name TEXT, version INTEGER, "
+                        "value TEXT, PRIMARY KEY (smiles, name, version))")
+        self.pending = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=MISSING):
+        """
+        Return the value for a (smiles, name, version) key, or default.
+        """
+        row = self.db.execute("SELECT value FROM descriptors WHERE smiles = ? AND name = ? AND version = ?",
+                              key).fetchone()
+        if row is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        """
+        Store the value for a (smiles, name, version) key.
+        """
+        self.db.execute("INSERT OR REPLACE INTO descriptors (smiles, name, version, value) VALUES (?, ?, ?, ?)",
+                        tuple(key) + (json.dumps(value),))
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.flush()
+
+    def flush(self):
+        """
+        Commit pending writes.
+        """
+        self.db.commit()
+        self.pending = 0
+
+    def close(self):
+        """
+        Commit pending writes and close the database.
+        """
+        self.flush()
+        self.db.close()
+
+    def stats(self):
+        """
+        Return a dictionary of the hit and miss counts.
+        """
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+class DescriptorCache(object):
+    """
+    Memoize descriptor values by canonical SMILES, descriptor name and
+    descriptor version, in an in-process LRU cache of at most maxsize values
+    and, if a path is given, a persistent SQLite cache behind it.
+
+    compute() works like violet.descriptors.compute(). The molecule is
+    still parsed to find its canonical SMILES, but only descriptors that
+    aren't cached are computed.
+    """
+
+    def __init__(self, maxsize=100000, path=None):
+        self.memory = LRUCache(maxsize)
+        self.persistent = SQLiteCache(path) if path else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Close the persistent cache, if there is one.
+        """
+        if self.persistent is not None:
+            self.persistent.close()
+            self.persistent = None
+
+    def compute(self, smiles, descriptors=None, indigo=None):
+        """
+        Return an ordered dictionary of descriptor values for a SMILES
+        string, using cached values where possible.
+        """
+        descriptors = resolve(descriptors)
+        indigo = resolve_session(indigo)
+        prepared = PreparedMolecule(indigo, load_molecule(indigo, smiles))
+        # The aromatized form gives the same key for Kekule and aromatic
+        # spellings of a molecule.
+        canonical = prepared.form('aromatized').canonicalSmiles()
+
+        values = {}
+        missing = []
+        for name in descriptors:
+            key = (canonical, name, REGISTRY[name].version)
+            value = self.memory.get(key)
+            if value is MISSING and self.persistent is not None:
+                value = self.persistent.get(key)
+                if value is not MISSING:
+                    if REGISTRY[name].columns:
+                        value = tuple(value)
+                    self.memory.put(key, value)
+            if value is MISSING:
+                missing.append(name)
+            else:
+                values[name] = value
+
+        if missing:
+            for name, value in prepared.record(missing).items():
+                key = (canonical, name, REGISTRY[name].version)
+                self.memory.put(key, value)
+                if self.persistent is not None:
+                    self.persistent.put(key, value)
+                values[name] = value
+
+        return collections.OrderedDict((name, values[name]) for name in descriptors)
+
+    def stats(self):
+        """
+        Return a dictionary of statistics for the in-process cache and, under
+        'persistent', for the persistent cache.
+        """
+        stats = self.memory.stats()
+        if self.persistent is not None:
+            stats['persistent'] = self.persistent.stats()
+        return stats
+
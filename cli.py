@@ -0,0 +1,162 @@
+# Core imports
+import argparse
+import csv
+import json
+import sys
+
+# Violet library imports
+from violet.batch import Failure, run
+from violet.descriptors import REGISTRY, columns, flatten
+from violet.failures import FailureLog
+from violet.incremental import PreviousResults, refresh
+from violet.offsets import OffsetIndex, guess_format
+
+
+def read_smiles(stream):
+    """
+    Generate (id, smiles) pairs from lines holding a SMILES string and an
+    optional ID, separated by whitespace. Blank lines are skipped, and
+    records without an ID are given their record number, counting from 1,
+    as violet.offsets.OffsetIndex numbers them.
+    """
+    number = 0
+    for line in stream:
+        fields = line.split(None, 1)
+        if not fields:
+            continue
+        number += 1
+        if len(fields) == 2:
+            yield fields[1].strip(), fields[0]
+        else:
+            yield str(number), fields[0]
+
+
+def read_sdf(stream):
+    """
+    Generate (id, molfile) pairs from an SD file, one record at a time. The
+    ID is the title line of each record.
+    """
+    lines = []
+    for line in stream:
+        if line.startswith('$$$$'):
+            if lines:
+                yield lines[0].strip(), ''.join(lines)
+            lines = []
+        else:
+            lines.append(line)
+    if any(line.strip() for line in lines):
+        yield lines[0].strip(), ''.join(lines)
+
+
+def parse_args(argv):
+    """
+    Parse the command line arguments.
+    """
+    parser = argparse.ArgumentParser(prog='python -m violet',
+                                     description='Compute violet descriptors for a SMILES or SD file.')
+    parser.add_argument('input', nargs='?', default='-',
+                        help='input file, or - to read standard input (default)')
+    parser.add_argument('-f', '--format', choices=['smi', 'sdf'],
+                        help='input format (default: guessed from the file name, else smi)')
+    parser.add_argument('-d', '--descriptors', default=','.join(REGISTRY),
+                        help='comma-separated descriptors to compute (default: %(default)s)')
+    parser.add_argument('-o', '--output', choices=['csv', 'jsonl'], default='csv',
+                        help='output format (default: %(default)s)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes (default: %(default)s)')
+    parser.add_argument('--chunk-size', type=int, default=1000,
+                        help='molecules sent to a worker at a time (default: %(default)s)')
+    parser.add_argument('--cache', metavar='PATH',
+                        help='SQLite file in which descriptor values are cached between runs')
+    parser.add_argument('--cache-size', type=int, default=0,
+                        help='descriptor values memoized in memory by each worker (default: %(default)s)')
+    parser.add_argument('--shard', metavar='K/N',
+                        help='only process shard K (counting from 0) of N of the input file, using an '
+                             'offset index saved next to it')
+    parser.add_argument('--quarantine', metavar='PATH',
+                        help='JSON lines file to write molecules that fail to, with the function and error '
+                             'that failed them')
+    parser.add_argument('--previous', metavar='PATH',
+                        help='JSON lines results of an earlier run with --previous: reuse the values of '
+                             'molecules whose structure is unchanged and only compute the rest')
+    args = parser.parse_args(argv)
+
+    args.descriptors = [name.strip() for name in args.descriptors.split(',') if name.strip()]
+    for name in args.descriptors:
+        if name not in REGISTRY:
+            parser.error("unknown descriptor: %s" % (name))
+    if args.format is None:
+        args.format = guess_format(args.input)
+    if args.shard:
+        try:
+            args.shard = tuple(int(part) for part in args.shard.split('/'))
+            if len(args.shard) != 2 or not 0 <= args.shard[0] < args.shard[1]:
+                raise ValueError
+        except ValueError:
+            parser.error("--shard must be K/N with 0 <= K < N")
+        if args.input == '-':
+            parser.error("--shard needs an input file")
+    if args.previous:
+        if args.output != 'jsonl':
+            parser.error("--previous needs --output jsonl")
+        if args.cache or args.cache_size:
+            parser.error("--previous can't be combined with a cache")
+    return args
+
+
+def main(argv=None, stdout=None):
+    """
+    Run the command line interface. Results are written to stdout as they
+    are computed, so memory use doesn't depend on the size of the input.
+    Molecules that fail are counted, and written to the quarantine file if
+    one is given, and a summary of the failures is written to standard
+    error at the end. With --previous, the merged records and a summary of
+    what was reused are written.
+    """
+    args = parse_args(argv)
+    stdout = stdout or sys.stdout
+    if args.shard:
+        stream = OffsetIndex.open(args.input, args.format)
+        molecules = stream.iterate_shard(*args.shard)
+    else:
+        stream = sys.stdin if args.input == '-' else open(args.input)
+        reader = read_sdf if args.format == 'sdf' else read_smiles
+        molecules = reader(stream)
+
+    if args.output == 'csv':
+        writer = csv.writer(stdout, lineterminator='\n')
+        writer.writerow(['id'] + columns(args.descriptors))
+
+    failures = FailureLog(args.quarantine)
+    try:
+        if args.previous:
+            previous = PreviousResults(args.previous, args.descriptors)
+            try:
+                for record in refresh(previous, molecules, args.jobs, args.chunk_size):
+                    if isinstance(record, Failure):
+                        failures.append(record)
+                    else:
+                        stdout.write(json.dumps(record) + '\n')
+            finally:
+                previous.close()
+            sys.stderr.write("%(reused)d of %(previous)d previous records reused\n" % previous.stats())
+            return 0
+
+        for outcome in run(molecules, args.descriptors, args.jobs, args.chunk_size,
+                           cache_size=args.cache_size, cache_path=args.cache):
+            if isinstance(outcome, Failure):
+                failures.append(outcome)
+            elif args.output == 'csv':
+                writer.writerow([outcome.id] + flatten(outcome.values))
+            else:
+                record = {'id': outcome.id}
+                record.update(outcome.values)
+                stdout.write(json.dumps(record) + '\n')
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+        failures.close()
+        if failures:
+            sys.stderr.write(failures.summary() + '\n')
+    return 0
+
@@ -0,0 +1,202 @@
+# Core imports
+import collections
+
+# Violet library imports
+from violet import instrument
+from violet.failures import tag
+from violet.murcko import murcko
+from violet.murcko_alpha import murcko_alpha
+from violet.rotatable_bonds import count_rotatable_bonds
+from violet.session import get as get_session, load_molecule, resolve_session
+from violet.sp3carbon import count_sp3carbon
+from violet.tpsa import default_calculator
+
+
+# Each prepared form of a molecule is made by cloning its parent form and
+# applying a preparation step, which is timed as the named instrumentation
+# stage. The 'parsed' form is the molecule as loaded.
+FORMS = {
+    'dearomatized': ('parsed', 'dearomatize', lambda mol: mol.dearomatize()),
+    'aromatized': ('parsed', 'aromatize', lambda mol: mol.aromatize()),
+}
+
+# A descriptor reads the prepared form of a molecule that it declares, and
+# can ask for the raw result of another descriptor. The export function
+# turns the raw result into the value stored in a record. Descriptors whose
+# values are tuples name the columns that the tuple is split into. The
+# version must be increased whenever a descriptor's values change, so that
+# cached values are recomputed.
+Descriptor = collections.namedtuple("Descriptor", ["name", "form", "function", "export", "columns", "version"])
+
+# All registered descriptors, in registration order.
+REGISTRY = collections.OrderedDict()
+
+
+def register(name, form, export=None, columns=None, version=1):
+    """
+    Decorator that registers a function(mol, prepared) as a descriptor that
+    needs the given prepared form of the molecule.
+    """
+    if form != 'parsed' and form not in FORMS:
+        raise ValueError("Unknown molecule form: %s" % (form))
+
+    def decorator(function):
+        REGISTRY[name] = Descriptor(name, form, function, export, columns, version)
+        return function
+    return decorator
+
+
+def canonical_smiles(mol):
+    """
+    Export an Indigo molecule, or None, as the canonical SMILES string of
+    its aromatized form, so that Kekule and aromatic spellings of a
+    molecule give the same string.
+    """
+    if mol is None:
+        return None
+    with instrument.stage('canonical_smiles'):
+        mol = mol.clone()
+        mol.aromatize()
+        return mol.canonicalSmiles()
+
+
+def resolve(descriptors):
+    """
+    Return a list of descriptor names, checking that each is registered.
+    None means every registered descriptor.
+    """
+    if descriptors is None:
+        return list(REGISTRY)
+    for name in descriptors:
+        if name not in REGISTRY:
+            raise ValueError("Unknown descriptor: %s" % (name))
+    return list(descriptors)
+
+
+def columns(descriptors):
+    """
+    Return the flat list of column names for a list of descriptor names.
+    """
+    names = []
+    for name in descriptors:
+        names.extend(REGISTRY[name].columns or [name])
+    return names
+
+
+def flatten(record):
+    """
+    Return the values of a record as a flat list, in the order given by
+    columns().
+    """
+    values = []
+    for name, value in record.items():
+        if REGISTRY[name].columns:
+            values.extend(value)
+        else:
+            values.append(value)
+    return values
+
+
+class PreparedMolecule(object):
+    """
+    A molecule parsed once, with each prepared form and descriptor result
+    built on first use and shared from then on.
+    """
+
+    def __init__(self, indigo, mol):
+        self.indigo = indigo
+        self.forms = {'parsed': mol}
+        self.results = {}
+
+    def form(self, name):
+        """
+        Return the named prepared form of the molecule.
+        """
+        if name not in self.forms:
+            parent, stage, prepare = FORMS[name]
+            mol = self.form(parent).clone()
+            with instrument.stage(stage):
+                prepare(mol)
+            self.forms[name] = mol
+        return self.forms[name]
+
+    def result(self, name):
+        """
+        Return the raw result of the named descriptor. Exceptions are tagged
+        with the descriptor's name, for violet.failures.
+        """
+        if name not in self.results:
+            descriptor = REGISTRY[name]
+            try:
+                mol = self.form(descriptor.form)
+                with instrument.stage('descriptor:' + name):
+                    self.results[name] = descriptor.function(mol, self)
+            except Exception as e:
+                raise tag(e, name)
+        return self.results[name]
+
+    def record(self, descriptors):
+        """
+        Return an ordered dictionary of exported descriptor values.
+        """
+        record = collections.OrderedDict()
+        for name in descriptors:
+            value = self.result(name)
+            export = REGISTRY[name].export
+            record[name] = export(value) if export else value
+        return record
+
+
+@register('tpsa', 'dearomatized')
+def _tpsa(mol, prepared):
+    return default_calculator(prepared.indigo).compute_dearomatized(mol)
+
+
+@register('rotatable_bonds', 'aromatized')
+def _rotatable_bonds(mol, prepared):
+    return count_rotatable_bonds(prepared.indigo, mol)
+
+
+@register('sp3carbon', 'aromatized', columns=['num_carbon', 'num_carbon_sp3', 'sp3_fraction'])
+def _sp3carbon(mol, prepared):
+    return count_sp3carbon(mol)
+
+
+@register('murcko', 'parsed', export=canonical_smiles, version=2)
+def _murcko(mol, prepared):
+    return murcko(mol, strict=True)
+
+
+@register('murcko_alpha', 'parsed', export=canonical_smiles, version=2)
+def _murcko_alpha(mol, prepared):
+    # Share the framework with the murcko descriptor. A molecule without a
+    # framework has no alpha scaffold either.
+    framework = prepared.result('murcko')
+    if framework is None:
+        return None
+    return murcko_alpha(mol, framework, strict=True)
+
+
+def default_indigo():
+    """
+    Return the Indigo session that compute() uses by default: the session
+    of the default profile for this thread.
+    """
+    return get_session()
+
+
+def compute(smiles, descriptors=None, indigo=None):
+    """
+    Compute several descriptors for a molecule specified as a SMILES string,
+    parsing it once and preparing each form of the molecule once. Returns an
+    ordered dictionary of values keyed by descriptor name; scaffolds are
+    given as canonical SMILES. By default every registered descriptor is
+    computed. indigo can be an Indigo session or the name of a session
+    profile. Raises IndigoException if the SMILES can't be loaded.
+    """
+    descriptors = resolve(descriptors)
+    indigo = resolve_session(indigo)
+
+    prepared = PreparedMolecule(indigo, load_molecule(indigo, smiles))
+    return prepared.record(descriptors)
+
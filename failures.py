@@ -0,0 +1,107 @@
+# Core imports
+import collections
+import json
+
+
+class Failure(collections.namedtuple("Failure", ["index", "id", "smiles", "function", "error_class", "message"])):
+    """
+    A molecule that couldn't be processed: its position in the input, its
+    input ID and SMILES string (None if it was given as an Indigo object),
+    the violet function that failed ('parse' if the molecule couldn't be
+    loaded, otherwise a descriptor or function name), and the class and
+    message of the exception.
+    """
+    __slots__ = ()
+
+    @property
+    def error(self):
+        """
+        The error class and message as one string.
+        """
+        return "%s: %s" % (self.error_class, self.message)
+
+
+def tag(exception, function):
+    """
+    Record the function that an exception was raised in, unless a function
+    it was raised from inside has already done so. Returns the exception.
+    """
+    if not hasattr(exception, 'violet_function'):
+        exception.violet_function = function
+    return exception
+
+
+def from_exception(index, mol_id, smiles, exception, function=None):
+    """
+    Return the Failure for an exception raised processing a molecule. The
+    function recorded by tag() is used if there is one.
+    """
+    return Failure(index, mol_id, smiles, getattr(exception, 'violet_function', function),
+                   type(exception).__name__, str(exception).strip())
+
+
+class FailureLog(object):
+    """
+    Collect Failures as counts by function and error class and, if a path
+    is given, write each one as a line of JSON to a quarantine file, from
+    which quarantined() can read them back. Nothing is logged or printed
+    per failure.
+
+    A FailureLog can be given wherever a list is accepted for failures.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.counts = collections.Counter()
+        self._file = open(path, 'w') if path else None
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Close the quarantine file, if there is one.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def append(self, failure):
+        """
+        Count a Failure and quarantine it.
+        """
+        self.counts[failure.function, failure.error_class] += 1
+        if self._file is not None:
+            self._file.write(json.dumps(failure._asdict()) + '\n')
+
+    def stats(self):
+        """
+        Return a dictionary of the number of failures, in total and by
+        'function/error class'.
+        """
+        return {'failures': len(self),
+                'by_error': collections.OrderedDict(('%s/%s' % key, count)
+                                                    for key, count in self.counts.most_common())}
+
+    def summary(self):
+        """
+        Return a one line summary of the failures, most common first.
+        """
+        return "%d failed (%s)" % (len(self), ', '.join('%s/%s: %d' % (function, error_class, count)
+                                                       for (function, error_class), count in self.counts.most_common()))
+
+
+def quarantined(path):
+    """
+    Generate the Failures in a quarantine file.
+    """
+    with open(path) as fh:
+        for line in fh:
+            if line.strip():
+                yield Failure(**json.loads(line))
@@ -0,0 +1,191 @@
+# Core imports
+import array
+import bisect
+import collections
+import json
+import os
+
+# Violet library imports
+from violet.batch import Failure, Unchanged, run
+from violet.descriptors import PreparedMolecule, REGISTRY, load_molecule, resolve
+from violet.scaffolds import scaffold_key
+
+
+def _find(keys, key):
+    """
+    Return the position of a key in a sorted array, or None.
+    """
+    i = bisect.bisect_left(keys, key)
+    if i < len(keys) and keys[i] == key:
+        return i
+    return None
+
+
+def versions(descriptors):
+    """
+    Return a dictionary of the current version of each descriptor.
+    """
+    return collections.OrderedDict((name, REGISTRY[name].version) for name in descriptors)
+
+
+class PreviousResults(object):
+    """
+    The records of a results file written by refresh() that hold current
+    versions of a set of descriptors, indexed by structure key: the 64 bit
+    hash of the canonical SMILES of the molecule's aromatized form, as
+    violet.cache keys it. Each record is also indexed by its input key, the
+    hash of the SMILES string or molfile it was computed from, so that an
+    input that hasn't changed is recognized without parsing it.
+
+    The keys are held in sorted arrays (16 bytes per record) and the records
+    themselves are read from the file when they are reused. A missing file
+    is treated as empty.
+    """
+
+    def __init__(self, path, descriptors=None):
+        self.path = path
+        self.descriptors = resolve(descriptors)
+        current = versions(self.descriptors)
+        self.count = 0
+        structures = []
+        inputs = []
+        if os.path.exists(path):
+            with open(path, 'rb') as fh:
+                offset = 0
+                for line in fh:
+                    if line.strip():
+                        self.count += 1
+                        record = json.loads(line)
+                        stored = record.get('versions', {})
+                        if 'key' in record and all(stored.get(name) == version for name, version in current.items()):
+                            structures.append((record['key'], offset))
+                            inputs.append((record['input_key'], record['key']))
+                    offset += len(line)
+        structures.sort()
+        inputs.sort()
+        self.keys = array.array('q', [key for key, _ in structures])
+        self.offsets = array.array('Q', [offset for _, offset in structures])
+        self.input_keys = array.array('q', [key for key, _ in inputs])
+        self.input_structures = array.array('q', [key for _, key in inputs])
+        self.reused = bytearray(len(self.keys))
+        self.unchanged = 0
+        self._file = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __getstate__(self):
+        # Workers only need the keys.
+        state = self.__dict__.copy()
+        state['offsets'] = state['reused'] = state['_file'] = None
+        return state
+
+    def close(self):
+        """
+        Close the results file, if it is open.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def compute(self, smiles, descriptors, indigo):
+        """
+        Return the (structure key, input key) pair of a molecule and its
+        descriptor values, or None for the values if they can be reused.
+        Molecules are only parsed if their input key isn't known.
+        """
+        input_key = scaffold_key(smiles)
+        i = _find(self.input_keys, input_key)
+        if i is not None:
+            return (self.input_structures[i], input_key), None
+        prepared = PreparedMolecule(indigo, load_molecule(indigo, smiles))
+        key = scaffold_key(prepared.form('aromatized').canonicalSmiles())
+        if _find(self.keys, key) is not None:
+            return (key, input_key), None
+        return (key, input_key), prepared.record(descriptors)
+
+    def record(self, key):
+        """
+        Return the previous record with a structure key.
+        """
+        i = _find(self.keys, key)
+        if self._file is None:
+            self._file = open(self.path, 'rb')
+        self._file.seek(self.offsets[i])
+        self.reused[i] = 1
+        self.unchanged += 1
+        return json.loads(self._file.readline())
+
+    def stats(self):
+        """
+        Return a dictionary of the number of previous records, those that
+        hold current values, and those reused so far.
+        """
+        return {'previous': self.count, 'current': len(self.keys), 'reused': self.reused.count(1)}
+
+
+def refresh(previous, molecules, jobs=1, chunk_size=1000):
+    """
+    Generate merged result records, in input order, for an iterable of
+    SMILES strings or (id, smiles) pairs, reusing the values in previous, a
+    PreviousResults, for molecules whose structure is unchanged and
+    computing the rest. Molecules that fail are generated as Failures.
+    Previous records of molecules that are no longer in the input are
+    dropped.
+
+    Each record holds the id and descriptor values, as the command line
+    interface writes them, followed by the keys and descriptor versions
+    that the next refresh needs.
+    """
+    current = versions(previous.descriptors)
+    for outcome in run(molecules, previous.descriptors, jobs, chunk_size, ordered=True, previous=previous):
+        if isinstance(outcome, Failure):
+            yield outcome
+            continue
+        record = collections.OrderedDict([('id', outcome.id)])
+        if isinstance(outcome, Unchanged):
+            values = previous.record(outcome.key[0])
+            for name in previous.descriptors:
+                record[name] = values[name]
+        else:
+            record.update(outcome.values)
+        record['key'], record['input_key'] = outcome.key
+        record['versions'] = current
+        yield record
+
+
+def refresh_file(previous_path, molecules, output_path=None, descriptors=None, jobs=1, chunk_size=1000):
+    """
+    Refresh the results file at previous_path for new input, writing the
+    merged records to output_path, by default replacing the previous file
+    once the new one is complete. Returns a (stats, failures) pair, where
+    stats counts the input molecules, those whose values were computed,
+    reused and that failed, and the previous records.
+    """
+    output_path = output_path or previous_path
+    previous = PreviousResults(previous_path, descriptors)
+    molecules_done = 0
+    failures = []
+    temporary = output_path + '.tmp'
+    try:
+        with open(temporary, 'w') as fh:
+            for record in refresh(previous, molecules, jobs, chunk_size):
+                molecules_done += 1
+                if isinstance(record, Failure):
+                    failures.append(record)
+                else:
+                    fh.write(json.dumps(record) + '\n')
+        os.replace(temporary, output_path)
+    finally:
+        previous.close()
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+    stats = collections.OrderedDict([
+        ('molecules', molecules_done),
+        ('computed', molecules_done - previous.unchanged - len(failures)),
+        ('unchanged', previous.unchanged),
+        ('failed', len(failures)),
+    ])
+    stats.update(previous.stats())
+    return stats, failures
@@ -0,0 +1,186 @@
+# Core imports
+import contextlib
+import time
+
+
+# Whether stages and counters are being recorded. Set by enable() and
+# disable(), and read on every call to stage() and count().
+enabled = False
+
+# The calls and nanoseconds recorded for each stage, and the counters.
+_stages = {}
+_counters = {}
+
+# Functions called with (stage, seconds) each time a stage finishes.
+_hooks = []
+
+
+class _Stage(object):
+    """
+    Times one pass through a stage.
+    """
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.name, time.perf_counter_ns() - self.start)
+
+
+class _NullStage(object):
+    """
+    Stands in for a stage when instrumentation is disabled.
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name):
+    """
+    Return a context manager that times the code it wraps as the named
+    stage, such as 'parse' or 'match'. Stages can nest, so the times of
+    different stages can overlap. When instrumentation is disabled this
+    costs one function call and a flag test.
+    """
+    if not enabled:
+        return _NULL_STAGE
+    return _Stage(name)
+
+
+def record(name, nanoseconds):
+    """
+    Record one call of a stage that took the given number of nanoseconds.
+    """
+    totals = _stages.get(name)
+    if totals is None:
+        totals = _stages[name] = [0, 0]
+    totals[0] += 1
+    totals[1] += nanoseconds
+    for hook in _hooks:
+        hook(name, nanoseconds / 1e9)
+
+
+def count(name, n=1):
+    """
+    Add n to the named counter, such as 'molecules' or 'failures', if
+    instrumentation is enabled.
+    """
+    if enabled:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def enable():
+    """
+    Start recording stages and counters.
+    """
+    global enabled
+    enabled = True
+
+
+def disable():
+    """
+    Stop recording stages and counters. What was recorded is kept.
+    """
+    global enabled
+    enabled = False
+
+
+def reset():
+    """
+    Forget everything recorded so far.
+    """
+    _stages.clear()
+    _counters.clear()
+
+
+def snapshot():
+    """
+    Return a dictionary of what has been recorded: under 'stages', the calls
+    and total seconds of each stage, and under 'counters', each counter.
+    """
+    return {
+        'stages': dict((name, {'calls': calls, 'seconds': nanoseconds / 1e9})
+                       for name, (calls, nanoseconds) in _stages.items()),
+        'counters': dict(_counters),
+    }
+
+
+def merge(other):
+    """
+    Add a snapshot, such as one taken in a worker process, to what has been
+    recorded here.
+    """
+    for name, totals in other['stages'].items():
+        mine = _stages.setdefault(name, [0, 0])
+        mine[0] += totals['calls']
+        mine[1] += int(round(totals['seconds'] * 1e9))
+    for name, n in other['counters'].items():
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def add_hook(hook):
+    """
+    Call hook(stage, seconds) each time a stage finishes.
+    """
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    """
+    Stop calling a hook added with add_hook().
+    """
+    _hooks.remove(hook)
+
+
+@contextlib.contextmanager
+def recording(hook=None):
+    """
+    Context manager that clears what has been recorded, records stages and
+    counters for the duration of the block, calling hook if one is given,
+    and yields a dictionary that holds the snapshot() when the block ends.
+
+        with instrument.recording() as stats:
+            batch.collect(smiles)
+        print(stats['stages']['parse'])
+    """
+    was_enabled = enabled
+    reset()
+    if hook is not None:
+        add_hook(hook)
+    enable()
+    stats = {}
+    try:
+        yield stats
+    finally:
+        if not was_enabled:
+            disable()
+        if hook is not None:
+            remove_hook(hook)
+        stats.update(snapshot())
+
+
+def measured(function, *args):
+    """
+    Call a function in a worker process and return a (result, snapshot)
+    pair, where the snapshot holds only what the call recorded, ready to be
+    merged by the parent process. The snapshot is None when
+    instrumentation is disabled.
+    """
+    if not enabled:
+        return function(*args), None
+    reset()
+    result = function(*args)
+    return result, snapshot()
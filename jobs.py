@@ -0,0 +1,144 @@
+# Core imports
+import itertools
+import json
+import sqlite3
+
+# Violet library imports
+from violet.batch import Failure, run
+from violet.descriptors import resolve
+from violet.scaffolds import ScaffoldIndex
+
+
+class DescriptorJob(object):
+    """
+    A bulk descriptor computation whose results are kept in an SQLite
+    database at path, with a checkpoint committed every checkpoint_every
+    molecules.
+
+    Each checkpoint writes the results and failures since the last one and
+    the number of input molecules done in a single transaction, so the
+    database always holds exactly the results for the first done molecules
+    of the input. If a run dies, running the job again on the same input
+    skips the molecules that are done and carries on, without duplicating
+    or losing any.
+    """
+
+    def __init__(self, path, descriptors=None, checkpoint_every=10000):
+        self.path = path
+        self.checkpoint_every = checkpoint_every
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS progress (name TEXT PRIMARY KEY, value TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS results (position INTEGER PRIMARY KEY, id TEXT, record TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS failures "
+                        "(position INTEGER PRIMARY KEY, id TEXT, smiles TEXT, error TEXT)")
+        progress = dict(self.db.execute("SELECT name, value FROM progress"))
+
+        # A job keeps the descriptors it was started with.
+        descriptors = resolve(descriptors)
+        if 'descriptors' in progress:
+            started = json.loads(progress['descriptors'])
+            if started != descriptors:
+                raise ValueError("The job at %s computes %s, not %s." % (path, ', '.join(started),
+                                                                         ', '.join(descriptors)))
+        else:
+            with self.db:
+                self.db.execute("INSERT INTO progress (name, value) VALUES ('descriptors', ?)",
+                                (json.dumps(descriptors),))
+        self.descriptors = descriptors
+        self.done = int(progress.get('done', 0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Close the database. Work since the last checkpoint is not saved.
+        """
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def run(self, molecules, jobs=1, chunk_size=1000):
+        """
+        Compute the descriptors for an iterable of SMILES strings or
+        (id, smiles) pairs, starting after the molecules that are already
+        done, and checkpointing as it goes. molecules must be the same input,
+        in the same order, each time the job is run. An OffsetIndex can be
+        given instead, in which case the done molecules aren't read at all.
+        Returns the number of molecules done.
+        """
+        if hasattr(molecules, 'records'):
+            remaining = molecules.records(self.done)
+        else:
+            # Plain SMILES strings are given their position in the whole
+            # input as an ID, as the batch runner numbers them.
+            remaining = (item if not isinstance(item, str) else (position, item)
+                         for position, item in enumerate(itertools.islice(molecules, self.done, None), self.done))
+
+        start = done = self.done
+        results = []
+        failures = []
+        for outcome in run(remaining, self.descriptors, jobs, chunk_size, ordered=True):
+            position = start + outcome.index
+            if isinstance(outcome, Failure):
+                failures.append((position, str(outcome.id), outcome.smiles, outcome.error))
+            else:
+                results.append((position, str(outcome.id), json.dumps(outcome.values)))
+            # Outcomes arrive in input order, so every molecule up to this
+            # one is done.
+            done = position + 1
+            if done - self.done >= self.checkpoint_every:
+                self.checkpoint(results, failures, done)
+                results = []
+                failures = []
+        self.checkpoint(results, failures, done)
+        return self.done
+
+    def checkpoint(self, results, failures, done):
+        """
+        Commit results, failures and the number of molecules done in one
+        transaction.
+        """
+        with self.db:
+            self.db.executemany("INSERT INTO results (position, id, record) VALUES (?, ?, ?)", results)
+            self.db.executemany("INSERT INTO failures (position, id, smiles, error) VALUES (?, ?, ?, ?)",
+                                failures)
+            self.db.execute("INSERT OR REPLACE INTO progress (name, value) VALUES ('done', ?)", (str(done),))
+        self.done = done
+
+    def results(self):
+        """
+        Generate (position, id, record) tuples for the molecules done, in
+        input order, where record is a dictionary of descriptor values.
+        """
+        for position, mol_id, record in self.db.execute(
+                "SELECT position, id, record FROM results ORDER BY position"):
+            yield position, mol_id, json.loads(record)
+
+    def failures(self):
+        """
+        Generate (position, id, smiles, error) tuples for the molecules that
+        failed, in input order.
+        """
+        for row in self.db.execute("SELECT position, id, smiles, error FROM failures ORDER BY position"):
+            yield row
+
+
+def run_scaffold_job(path, molecules, kind='murcko', checkpoint_every=100000, member_ids=False, indigo=None):
+    """
+    Add an iterable of (id, smiles) pairs, or an OffsetIndex, to the
+    ScaffoldIndex kept at path, resuming after the molecules added by an
+    earlier run that died. The index checkpoints its counts and position
+    every checkpoint_every molecules. Returns the open ScaffoldIndex.
+    """
+    index = ScaffoldIndex(kind, path, member_ids, checkpoint_every, indigo)
+    if hasattr(molecules, 'records'):
+        remaining = molecules.records(index.position)
+    else:
+        remaining = itertools.islice(molecules, index.position, None)
+    index.add_many(remaining)
+    index.flush()
+    return index
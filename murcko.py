@@ -1,13 +1,107 @@
 # Core imports
+import collections
 import logging
 
 # Third-party module imports
 import indigo as indigo_module
+from indigo import IndigoException
 
+# Violet library imports
+from violet import instrument
 
-def murcko(indigo_obj):
+
+def peel(mol, anchors=frozenset()):
+    """
+    Return the set of indices of the atoms that are stripped from a molecule
+    when terminal atoms are repeatedly removed. Atoms that are multiply
+    bonded to an atom with three or more connections (such as exocyclic
+    carbonyl oxygens) are kept while that atom keeps its connections, and
+    atoms bonded to an anchor atom are always kept. The molecule isn't
+    modified.
+
+    The terminal atoms are stripped with a work queue, looking up the bonds
+    of each atom at most once, so the molecule is processed in
+    O(atoms + bonds) time.
+    """
+    # Record the number of connections of each atom. The neighbours of
+    # an atom, and the order of the bond to each, are only looked up
+    # when the atom is reached by the peeling, and only once.
+    degree = {}
+    for atom in mol.iterateAtoms():
+        degree[atom.index()] = atom.degree()
+    neighbours = {}
+
+    def neighbours_of(index):
+        if index not in neighbours:
+            neighbours[index] = dict((nei.index(), nei.bond().bondOrder())
+                                     for nei in mol.getAtom(index).iterateNeighbors())
+        return neighbours[index]
+
+    # Atoms with 0 or 1 connections are candidates for removal.
+    removed = set()
+    kept = collections.defaultdict(list)
+    hanging_atoms = collections.deque(index for index in degree if degree[index] <= 1)
+    while hanging_atoms:
+        atom = hanging_atoms.popleft()
+        if atom in removed or degree[atom] > 1:
+            continue
+        bonds = neighbours_of(atom)
+        remaining = [nei for nei in bonds if nei not in removed]
+        # Keep an atom bonded to an anchor, and a multiply bonded atom
+        # while its neighbour has three or more connections. Kept atoms are
+        # looked at again if their neighbour loses a connection.
+        if remaining and (remaining[0] in anchors or
+                          (bonds[remaining[0]] != 1 and degree[remaining[0]] > 2)):
+            kept[remaining[0]].append(atom)
+            continue
+        removed.add(atom)
+        for nei in remaining:
+            degree[nei] -= 1
+            if degree[nei] <= 1:
+                hanging_atoms.append(nei)
+            elif degree[nei] == 2:
+                # Multiply bonded atoms kept on this neighbour can now go.
+                hanging_atoms.extend(kept.pop(nei, []))
+
+    return removed
+
+
+def murcko(indigo_obj, strict=False):
     """
     Generate the Bemis-Murcko scaffold for a molecule.
+
+    The atoms found by peel() are removed with a single call to
+    removeAtoms(). Returns None if no ring is left. Indigo errors are
+    logged and give None, or are raised if strict is True.
+    """
+    with instrument.stage('murcko'):
+        mol = indigo_obj.clone()
+
+        try:
+            removed = peel(mol)
+            if removed:
+                mol.removeAtoms(sorted(removed))
+                # If the number of remaining atoms is less than 3, there can't be a ring, therefore there can't be a scaffold.
+                if (mol.countAtoms() < 3):
+                    mol = None
+
+        except IndigoException as e:
+            if strict:
+                raise
+            instrument.count('failures')
+            logging.error("IndigoException: %s" % (e))
+            mol = None
+
+    return mol
+
+
+def murcko_reference(indigo_obj):
+    """
+    Generate the Bemis-Murcko scaffold for a molecule by repeatedly peeling
+    off terminal atoms. This is the original implementation of murcko(),
+    kept as a reference for testing. It returns None for molecules that
+    contain an acyclic fragment that is peeled down to a single atom, such
+    as salts.
     """
     indigo = indigo_module.Indigo()
     if not indigo:
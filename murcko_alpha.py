@@ -3,16 +3,85 @@ import logging
 
 # Third-party module imports
 import indigo as indigo_module
+from indigo import IndigoException
 
 # Violet library imports
-from violet import murcko
+from violet import instrument
+from violet.murcko import murcko, peel
 
 
-def murcko_alpha(indigo_obj, murcko_fwk=False):
+def murcko_alpha(indigo_obj, murcko_fwk=False, strict=False):
     """
     Generate the Bemis-Murcko scaffold for a molecule, but leave the 
     alpha atoms attached.
 
+    The general strategy is:
+      1) Obtain the molecule's Murcko framework, which is either passed as an
+         argument or calculated if necessary. The framework must have the
+         atom indices of the molecule, as murcko() gives.
+      2) Index the atom ID numbers of the framework once. These are the
+         framework's ring atoms plus its linker atoms, and every ring atom
+         of the molecule is among them.
+      3) Strip terminal atoms as murcko() does, except that an atom bonded
+         to an indexed framework atom is never stripped: it is either a ring
+         alpha atom or attached to a linker. Each check reads the index in
+         O(1), so the molecule is processed in O(atoms + bonds) time.
+
+    Molecules without a framework, and Indigo errors, are logged and give
+    None; with strict=True Indigo errors are raised instead.
+    """
+
+    try:
+        mol = indigo_obj.clone()
+
+        if murcko_fwk is False:
+            # Get the molecule's Murcko framework.
+            murcko_fwk = murcko(mol, strict)
+
+        if (murcko_fwk is None):
+            raise ValueError("This molecule doesn't have a Murcko framework. Stopping.")
+
+        with instrument.stage('murcko_alpha'):
+            framework_atoms = set(atom.index() for atom in murcko_fwk.iterateAtoms())
+            removed = peel(mol, framework_atoms)
+            if removed:
+                mol.removeAtoms(sorted(removed))
+                # If the number of remaining atoms is less than 3, there can't be a ring, therefore there can't be a scaffold.
+                if (mol.countAtoms() < 3):
+                    mol = None
+
+    except ValueError as e:
+        logging.error("murcko_alpha(): Exception: %s" % (e))
+        mol = None
+
+    except IndigoException as e:
+        if strict:
+            raise
+        instrument.count('failures')
+        logging.error("murcko_alpha(): IndigoException: %s" % (e))
+        mol = None
+
+    return mol
+
+
+def murcko_and_alpha(indigo_obj):
+    """
+    Return a (Murcko framework, alpha framework) pair for a molecule,
+    computing the Murcko framework once and sharing it. Both are None if the
+    molecule has no ring.
+    """
+    framework = murcko(indigo_obj)
+    if framework is None:
+        return None, None
+    return framework, murcko_alpha(indigo_obj, framework)
+
+
+def murcko_alpha_reference(indigo_obj, murcko_fwk=False):
+    """
+    Generate the Bemis-Murcko scaffold for a molecule, but leave the 
+    alpha atoms attached. This is the original implementation of
+    murcko_alpha(), kept as a reference for testing.
+
     The general strategy is:
       1) Obtain the molecule's Murcko framework, which is either passed as an
          argument or calculated if necessary.
@@ -0,0 +1,201 @@
+# Core imports
+import array
+import mmap
+import os
+import struct
+
+
+# The header of a saved index: a magic number, the format version, the
+# input format, and the size and modification time of the indexed file, so
+# that an index that no longer matches its file isn't used.
+HEADER = struct.Struct('<4sB3sQQQ')
+MAGIC = b'VIDX'
+VERSION = 1
+
+# Saved indexes are kept next to the indexed file, with this suffix.
+SUFFIX = '.vidx'
+
+# The formats that can be indexed.
+FORMATS = ('smi', 'sdf')
+
+
+def guess_format(path):
+    """
+    Return 'sdf' for .sdf and .sd files and 'smi' otherwise, as the command
+    line interface does.
+    """
+    return 'sdf' if path.lower().endswith(('.sdf', '.sd')) else 'smi'
+
+
+def scan(stream, format='smi'):
+    """
+    Return an array of the byte offsets at which the records of a binary
+    stream start, followed by the offset of its end. SMILES records are
+    non-blank lines and SD records end with a $$$$ line.
+    """
+    if format not in FORMATS:
+        raise ValueError("Unknown format: %s" % (format))
+    offsets = array.array('Q')
+    position = 0
+    if format == 'smi':
+        for line in stream:
+            if line.strip():
+                offsets.append(position)
+            position += len(line)
+    else:
+        start = 0
+        has_content = False
+        for line in stream:
+            position += len(line)
+            if line.startswith(b'$$$$'):
+                offsets.append(start)
+                start = position
+                has_content = False
+            elif line.strip():
+                has_content = True
+        # A last record without a $$$$ line.
+        if has_content:
+            offsets.append(start)
+    offsets.append(position)
+    return offsets
+
+
+class OffsetIndex(object):
+    """
+    The byte offsets of the records of a SMILES or SD file, held in a
+    compact array (8 bytes per record) and saved next to the file, which
+    gives random access to any record, range of records or shard of the
+    file without reading the rest of it.
+
+    Records are read from a memory map of the file. SMILES records are
+    generated as (id, smiles) pairs, where the id is the rest of the line,
+    or the record number counting from 1 if there isn't one, and SD
+    records as (title, molfile) pairs, as the command line interface reads
+    them.
+    """
+
+    def __init__(self, path, offsets, format='smi'):
+        self.path = path
+        self.offsets = offsets
+        self.format = format
+        self._file = None
+        self._map = None
+
+    @classmethod
+    def build(cls, path, format=None):
+        """
+        Index a file by reading it once.
+        """
+        format = format or guess_format(path)
+        with open(path, 'rb') as stream:
+            return cls(path, scan(stream, format), format)
+
+    @classmethod
+    def load(cls, path, index_path=None):
+        """
+        Load the saved index of a file. Returns None if there is no saved
+        index or the file has changed since it was made.
+        """
+        index_path = index_path or path + SUFFIX
+        if not os.path.exists(index_path):
+            return None
+        stat = os.stat(path)
+        with open(index_path, 'rb') as fh:
+            magic, version, format, size, mtime, count = HEADER.unpack(fh.read(HEADER.size))
+            if magic != MAGIC or version != VERSION or size != stat.st_size or mtime != stat.st_mtime_ns:
+                return None
+            offsets = array.array('Q')
+            offsets.fromfile(fh, count + 1)
+        return cls(path, offsets, format.decode('ascii'))
+
+    @classmethod
+    def open(cls, path, format=None, save=True):
+        """
+        Return the saved index of a file if it is up to date, or build it,
+        and save it if save is True.
+        """
+        index = cls.load(path)
+        if index is None or (format and index.format != format):
+            index = cls.build(path, format)
+            if save:
+                index.save()
+        return index
+
+    def save(self, index_path=None):
+        """
+        Save the index, by default next to the indexed file.
+        """
+        stat = os.stat(self.path)
+        with open(index_path or self.path + SUFFIX, 'wb') as fh:
+            fh.write(HEADER.pack(MAGIC, VERSION, self.format.encode('ascii'), stat.st_size,
+                                 stat.st_mtime_ns, len(self)))
+            self.offsets.tofile(fh)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Close the memory map of the file, if it is open.
+        """
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+            self._map = self._file = None
+
+    def shard(self, k, n):
+        """
+        Return the range of record numbers in shard k (counting from 0) of
+        n roughly equal, contiguous shards.
+        """
+        if not 0 <= k < n:
+            raise ValueError("Shard %d of %d doesn't exist." % (k, n))
+        return range(len(self) * k // n, len(self) * (k + 1) // n)
+
+    def raw(self, number):
+        """
+        Return the bytes of a record.
+        """
+        if self._map is None:
+            self._file = open(self.path, 'rb')
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map[self.offsets[number]:self.offsets[number + 1]]
+
+    def record(self, number):
+        """
+        Return a record as an (id, smiles) or (title, molfile) pair.
+        """
+        text = self.raw(number).decode('utf-8')
+        if self.format == 'sdf':
+            # Drop the $$$$ line that ends the record.
+            end = text.rfind('\n$$$$')
+            if end >= 0:
+                text = text[:end + 1]
+            return text.split('\n', 1)[0].strip(), text
+        fields = text.split(None, 1)
+        if len(fields) == 2:
+            return fields[1].strip(), fields[0]
+        return str(number + 1), fields[0]
+
+    def records(self, start=0, stop=None):
+        """
+        Generate the records numbered from start up to, but not including,
+        stop (by default the last record).
+        """
+        if stop is None or stop > len(self):
+            stop = len(self)
+        for number in range(start, stop):
+            yield self.record(number)
+
+    def iterate_shard(self, k, n):
+        """
+        Generate the records of shard k of n.
+        """
+        numbers = self.shard(k, n)
+        return self.records(numbers.start, numbers.stop)
@@ -1,66 +1,496 @@
+# Core imports
+import collections
+import concurrent.futures
+import itertools
+import logging
+
 # Third-party module imports
-import indigo as indigo_module
+from indigo import IndigoException
 
+# Violet library imports
+from violet import instrument
+from violet.session import PROFILES, configure, profile_of, resolve_session
 
-def reaction(smarts_string, mol1, mol2=False):
-    """
-    This is a convenience function that quickly runs a virtual reaction
-    and return the products.
 
+# Statistics for one depth of a multistep enumeration: the number of
+# reactants fed in, products generated and new products kept.
+DepthStats = collections.namedtuple("DepthStats", ["depth", "reactants", "generated", "new"])
+
+# The result of Reaction.multistep()
+Multistep = collections.namedtuple("Multistep", ["products", "stats", "stopped"])
+
+# A reactant that was left out of an enumeration: its slot, its position in
+# the slot's pool, its SMILES string and the reason, 'parse' if it can't be
+# loaded, 'template' if it matches none of the reaction's reactant templates
+# or 'react' if Indigo raised an exception enumerating its products.
+Reject = collections.namedtuple("Reject", ["slot", "index", "smiles", "reason"])
+
+# The result of Reaction.prescreen(): for each slot, the SMILES strings and
+# loaded molecules that match one of the reaction's templates, and their
+# positions in the slot's pool, and the Rejects.
+Prescreen = collections.namedtuple("Prescreen", ["smiles", "molecules", "rejects", "indices"])
+
+# The most products a single Indigo enumeration call may generate. Indigo
+# stops there without saying so, so a block that reaches it is split in two
+# and enumerated again.
+MAX_PRODUCTS_PER_CALL = PROFILES['reaction']['rpe-max-products-count']
+
+# The default number of reactants per slot in each enumerated block of a
+# grid. Indigo's enumeration time grows faster than linearly with the
+# number of reactants in a call that match their templates, so prescreened
+# grids, in which every reactant matches, are enumerated in smaller blocks.
+CHUNK_SIZE = 10
+PRESCREENED_CHUNK_SIZE = 3
+
+# The number of compiled reactions compiled_reaction() keeps per session.
+COMPILED_REACTIONS = 32
+
+
+class Reaction(object):
     """
-    products = []
-    try: 
-    
-        # Setup the Indigo library.
-        # Enable generation of multiple products from a reaction, but don't
-        # allow product molecules to be fed back in to be reacted a second
-        # time around.
-        indigo = indigo_module.Indigo()
-        indigo.setOption("rpe-multistep-reactions", "true")
-        indigo.setOption("rpe-max-depth", "1")
-        indigo.setOption("rpe-self-reaction", "false")
-        indigo.setOption("rpe-mode", "grid")
-
-        # Load the molecules into Indigo
-        molecules = indigo.createArray()
-        m1 = indigo.loadMolecule(mol1)
-        molecules.arrayAdd(m1)
+    A reaction SMARTS that is parsed and automapped once, and can then be
+    run over single sets of reactants or whole reactant pools.
 
-        if (mol2):
-            m2 = indigo.loadMolecule(mol2)
-            molecules.arrayAdd(m2)
+    By default the reaction belongs to this thread's session of the
+    'reaction' profile (see violet.session), which is set up to generate
+    multiple products from a reaction, but not to feed product molecules
+    back in to be reacted a second time around. A session of your own passed
+    as indigo is given the options of that profile; the session of another
+    profile raises ValueError, since its options can't be changed.
+    """
 
-        # Initialise a 2D array to hold the reactant table
-        reactant_table = indigo.createArray()
+    def __init__(self, smarts_string, indigo=None):
+        indigo = resolve_session(indigo or 'reaction')
+        if profile_of(indigo) != 'reaction':
+            configure(indigo, 'reaction')
+        self.indigo = indigo
+        self.smarts = smarts_string
 
         # Create the reaction Indigo variable
-        rxn = indigo.loadReactionSmarts(smarts_string)
+        self.rxn = indigo.loadReactionSmarts(smarts_string)
         # Keep mapped atoms
-        rxn.automap("keep")
+        self.rxn.automap("keep")
+        self.reactant_count = self.rxn.countReactants()
+        # The query molecule that a reactant must match to fill each slot.
+        self.templates = list(self.rxn.iterateReactants())
+
+    def load(self, smiles_list):
+        """
+        Load a list of SMILES strings, skipping any that can't be loaded.
+        """
+        return [mol for _, _, mol in self._load(0, enumerate(smiles_list), [])]
+
+    def _load(self, slot, pairs, rejects):
+        """
+        Load an iterable of (index, smiles) pairs of one slot as a list of
+        (index, smiles, molecule) triples, adding a Reject to rejects for
+        each one that can't be loaded.
+        """
+        entries = []
+        with instrument.stage('parse'):
+            for index, smiles in pairs:
+                try:
+                    entries.append((index, smiles, self.indigo.loadMolecule(smiles)))
+                except IndigoException:
+                    instrument.count('failures')
+                    rejects.append(Reject(slot, index, smiles, 'parse'))
+        return entries
+
+    def matches(self, mol, slot):
+        """
+        Return True if an Indigo molecule matches the template of a reactant
+        slot.
+        """
+        with instrument.stage('match'):
+            return self.indigo.substructureMatcher(mol).match(self.templates[slot]) is not None
+
+    def can_react(self, mol):
+        """
+        Return True if an Indigo molecule matches any of the reaction's
+        reactant templates. Indigo fills each slot with any reactant that
+        matches its template, whichever pool it came from, so a molecule
+        that matches none can't take part in the reaction.
+        """
+        return any(self.matches(mol, slot) for slot in range(self.reactant_count))
 
+    def prescreen(self, pools):
+        """
+        Load one iterable of SMILES strings per reactant slot, once each,
+        and keep only the molecules that match one of the reaction's
+        reactant templates. Returns a Prescreen tuple.
+        """
+        kept = []
+        rejects = []
+        for slot, pool in enumerate(pools):
+            slot_kept = []
+            for index, smiles, mol in self._load(slot, enumerate(pool), rejects):
+                if self.can_react(mol):
+                    slot_kept.append((index, smiles, mol))
+                else:
+                    rejects.append(Reject(slot, index, smiles, 'template'))
+            kept.append(slot_kept)
+        rejects.sort()
+        instrument.count('rejected', len(rejects))
+        return Prescreen([[smiles for _, smiles, _ in slot] for slot in kept],
+                         [[mol for _, _, mol in slot] for slot in kept],
+                         rejects,
+                         [[index for index, _, _ in slot] for slot in kept])
+
+    def run(self, slots, aromatic=False):
+        """
+        Run the reaction over a list holding a list of Indigo molecules for
+        each reactant slot, in grid mode, and return the canonical SMILES of
+        the products. Missing slots are left empty. With aromatic=True the
+        products are aromatized first, so that the same product always has
+        the same SMILES however it was made.
+        """
+        return self._run(slots, aromatic)[0]
+
+    def _run(self, slots, aromatic=False):
+        """
+        Run the reaction as run() does, returning the products and the
+        number of reactions Indigo enumerated.
+        """
         # Build the Indigo array of reactants
-        for i in range(0, rxn.countReactants()):
-            array = indigo.createArray()
-            if (i < molecules.count()):
-                array.arrayAdd(molecules.at(i))
+        reactant_table = self.indigo.createArray()
+        for i in range(self.reactant_count):
+            array = self.indigo.createArray()
+            if i < len(slots):
+                for mol in slots[i]:
+                    array.arrayAdd(mol)
             reactant_table.arrayAdd(array)
 
         # Enumerate the products
-        output_reactions = indigo.reactionProductEnumerate(rxn, reactant_table)
-        num_products = output_reactions.count()
-
-        if (num_products > 0):
-            # The reaction was successful. Add the products to products[] 
-            for i in range(num_products):
-                product = output_reactions.at(i)
-                for p in product.iterateProducts():
+        products = []
+        with instrument.stage('react'):
+            output_reactions = self.indigo.reactionProductEnumerate(self.rxn, reactant_table)
+        with instrument.stage('canonical_smiles'):
+            for i in range(output_reactions.count()):
+                for p in output_reactions.at(i).iterateProducts():
+                    if aromatic:
+                        p.aromatize()
                     products.append(p.canonicalSmiles())
+        instrument.count('products', len(products))
+        return products, output_reactions.count()
+
+    def products(self, *reactants):
+        """
+        Return the canonical SMILES of the products of one set of reactants,
+        given as one SMILES string per reactant slot. As in Indigo, a
+        reactant can fill any slot whose template it matches, so the order
+        of the reactants doesn't matter. Nothing is enumerated if none of
+        the reactants matches one of the templates.
+        """
+        with instrument.stage('parse'):
+            slots = [[self.indigo.loadMolecule(smiles)] for smiles in reactants]
+        for slot in range(self.reactant_count):
+            if not any(self.matches(mol, slot) for (mol,) in slots):
+                instrument.count('rejected')
+                return []
+        return self.run(slots)
+
+    def run_block(self, block, aromatic=False):
+        """
+        Enumerate one block of a reactant grid, a list holding a list of
+        (index, smiles, molecule) triples for each slot, and return its
+        products and a list of Rejects.
+
+        If Indigo raises an exception, the block is enumerated again one
+        combination of reactants at a time, keeping the products of those
+        that succeed. The reactants of each combination that fails are
+        rejected: those that failed in every combination they were in, or
+        all of them if there are none. A block that reaches
+        MAX_PRODUCTS_PER_CALL is split in two and each half enumerated.
+        """
+        rejects = []
+        products = self._run_block(block, aromatic, rejects)
+        return products, rejects
+
+    def _run_block(self, block, aromatic, rejects):
+        try:
+            products, count = self._run([[mol for _, _, mol in slot] for slot in block], aromatic)
+        except IndigoException:
+            return self._run_combinations(block, aromatic, rejects)
+        widest = max(range(len(block)), key=lambda slot: len(block[slot]))
+        if count >= MAX_PRODUCTS_PER_CALL and len(block[widest]) > 1:
+            half = len(block[widest]) // 2
+            products = []
+            for part in (block[widest][:half], block[widest][half:]):
+                products.extend(self._run_block(block[:widest] + [part] + block[widest + 1:], aromatic, rejects))
+        return products
+
+    def _run_combinations(self, block, aromatic, rejects):
+        products = []
+        failed = []
+        succeeded = set()
+        for combination in itertools.product(*block):
+            members = list(enumerate(combination))
+            try:
+                products.extend(self.run([[mol] for _, _, mol in combination], aromatic))
+            except IndigoException:
+                failed.append(members)
+                continue
+            succeeded.update((slot, index) for slot, (index, _, _) in members)
+        blamed = {}
+        for members in failed:
+            culprits = [member for member in members if (member[0], member[1][0]) not in succeeded] or members
+            for slot, (index, smiles, _) in culprits:
+                blamed[slot, index] = Reject(slot, index, smiles, 'react')
+        instrument.count('failures', len(blamed))
+        rejects.extend(blamed[key] for key in sorted(blamed))
+        return products
+
+    def enumerate(self, pools, unique=False, limit=None, chunk_size=None, jobs=1, aromatic=False, prescreen=False,
+                  rejects=None):
+        """
+        Lazily generate the canonical SMILES of the products of every
+        combination of reactants, given as one iterable of SMILES strings per
+        reactant slot. Reactants that can't be loaded, and those that make
+        Indigo raise an exception (see run_block()), are skipped, and added
+        as Rejects to the rejects list, if one is given.
+
+        With prescreen=True, each reactant is first matched against the
+        reaction's templates, and reactants that match none are rejected
+        rather than enumerated. As Indigo fills each slot with any reactant of a block
+        that matches its template, the blocks, and so the products, can
+        differ from those enumerated without the prescreen.
+
+        The reactant grid is split into blocks of chunk_size molecules per
+        slot (by default CHUNK_SIZE, or PRESCREENED_CHUNK_SIZE with
+        prescreen), and each block is enumerated with one Indigo call. With jobs
+        greater than 1, blocks are enumerated in a pool of worker processes
+        that each compile the reaction once. With unique=True, each product
+        is generated once. Generation stops after limit products. See run()
+        for aromatic.
+        """
+        pools = [list(pool) for pool in pools]
+        if len(pools) != self.reactant_count:
+            raise ValueError("The reaction needs %d reactant pools, %d were given."
+                             % (self.reactant_count, len(pools)))
+        if chunk_size is None:
+            chunk_size = PRESCREENED_CHUNK_SIZE if prescreen else CHUNK_SIZE
+        # Each reactant is kept with its position in its pool, to report it.
+        if prescreen:
+            screened = self.prescreen(pools)
+            if rejects is not None:
+                rejects.extend(screened.rejects)
+            pools = [list(zip(*slot)) for slot in zip(screened.indices, screened.smiles, screened.molecules)]
+        elif jobs == 1:
+            load_rejects = []
+            pools = [self._load(slot, enumerate(pool), load_rejects) for slot, pool in enumerate(pools)]
+            if rejects is not None:
+                rejects.extend(load_rejects)
+        else:
+            pools = [list(enumerate(pool)) for pool in pools]
+
+        if jobs == 1:
+            # Every reactant is loaded once and the blocks are enumerated
+            # here.
+            blocks = (self.run_block(block, aromatic) for block in _blocks(pools, chunk_size))
+        else:
+            # Workers are sent (index, smiles) pairs, and load them.
+            pools = [[entry[:2] for entry in pool] for pool in pools]
+            blocks = _run_parallel(self.smarts, _blocks(pools, chunk_size), jobs, aromatic)
+
+        seen = set()
+        count = 0
+        try:
+            for products, block_rejects in blocks:
+                if rejects is not None:
+                    rejects.extend(block_rejects)
+                for product in products:
+                    if unique:
+                        if product in seen:
+                            continue
+                        seen.add(product)
+                    if limit is not None and count >= limit:
+                        return
+                    count += 1
+                    yield product
+        finally:
+            blocks.close()
+
+
+    def canonical(self, smiles):
+        """
+        Return the aromatized canonical SMILES of a molecule, as run()
+        writes products with aromatic=True.
+        """
+        mol = self.indigo.loadMolecule(smiles)
+        mol.aromatize()
+        return mol.canonicalSmiles()
+
+    def multistep(self, reactants, partners=(), max_depth=3, max_products=None, max_visited=None,
+                  chunk_size=None, jobs=1):
+        """
+        Apply the reaction repeatedly, breadth first. The starting reactants
+        fill the first reactant slot and the remaining slots, if any, are
+        filled from the partners pools at every step. The new products of
+        each depth are the reactants of the next, and a visited set of
+        canonical SMILES makes sure that each intermediate is reacted once.
+
+        Enumeration stops after max_depth steps, after max_products new
+        products, when the visited set holds max_visited molecules (which
+        bounds memory use), or when a step makes nothing new. Returns a
+        Multistep tuple of the (depth, SMILES) products in the order they
+        were found, a DepthStats tuple per depth and the reason for
+        stopping.
+        """
+        partners = [list(pool) for pool in partners]
+        if 1 + len(partners) != self.reactant_count:
+            raise ValueError("The reaction needs %d partner pools, %d were given."
+                             % (self.reactant_count - 1, len(partners)))
+
+        visited = set()
+        frontier = []
+        for smiles in reactants:
+            try:
+                smiles = self.canonical(smiles)
+            except IndigoException:
+                continue
+            if smiles not in visited:
+                visited.add(smiles)
+                frontier.append(smiles)
+
+        products = []
+        stats = []
+        stopped = None
+        depth = 0
+        while frontier and stopped is None:
+            if depth >= max_depth:
+                stopped = 'max_depth'
+                break
+            depth += 1
+            generated = 0
+            new = []
+            for product in self.enumerate([frontier] + partners, chunk_size=chunk_size, jobs=jobs,
+                                          aromatic=True):
+                generated += 1
+                if product in visited:
+                    continue
+                if max_visited is not None and len(visited) >= max_visited:
+                    stopped = 'max_visited'
+                    break
+                visited.add(product)
+                new.append(product)
+                products.append((depth, product))
+                if max_products is not None and len(products) >= max_products:
+                    stopped = 'max_products'
+                    break
+            stats.append(DepthStats(depth, len(frontier), generated, len(new)))
+            frontier = new
+        return Multistep(products, stats, stopped or 'exhausted')
+
+
+def _blocks(pools, chunk_size):
+    """
+    Generate the blocks of the reactant grid, as a list with one slice of
+    each pool.
+    """
+    starts = [range(0, len(pool), chunk_size) for pool in pools]
+    for block_starts in itertools.product(*starts):
+        yield [pool[start:start+chunk_size] for pool, start in zip(pools, block_starts)]
+
+
+# The compiled reaction of a worker process, set by _init_worker().
+_worker_reaction = None
+
+
+def _init_worker(smarts_string, instrumented=False):
+    """
+    Compile the reaction once per worker process, enabling instrumentation
+    if it is enabled in the parent.
+    """
+    global _worker_reaction
+    if instrumented:
+        instrument.enable()
+    _worker_reaction = Reaction(smarts_string)
+
+
+def _run_block(block, aromatic):
+    """
+    Enumerate one block of (index, smiles) pairs in a worker process,
+    returning its products and Rejects.
+    """
+    rejects = []
+    block = [_worker_reaction._load(slot, pairs, rejects) for slot, pairs in enumerate(block)]
+    products, block_rejects = _worker_reaction.run_block(block, aromatic)
+    return products, rejects + block_rejects
+
+
+def _merged(future):
+    """
+    Return the result of a worker's future, merging in what the worker's
+    instrumentation recorded.
+    """
+    result, stats = future.result()
+    if stats:
+        instrument.merge(stats)
+    return result
+
+
+def _run_parallel(smarts_string, blocks, jobs, aromatic):
+    """
+    Generate the products of each block, in order, from a pool of worker
+    processes, with at most two blocks per worker in flight.
+    """
+    executor = concurrent.futures.ProcessPoolExecutor(jobs, initializer=_init_worker,
+                                                      initargs=(smarts_string, instrument.enabled))
+    pending = collections.deque()
+    try:
+        for block in blocks:
+            pending.append(executor.submit(instrument.measured, _run_block, block, aromatic))
+            if len(pending) >= 2*jobs:
+                yield _merged(pending.popleft())
+        while pending:
+            yield _merged(pending.popleft())
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def compiled_reaction(smarts_string, session=None):
+    """
+    Return a cached Reaction for a SMARTS string in a session, by default
+    this thread's session of the 'reaction' profile. The most recently used
+    COMPILED_REACTIONS reactions of each session are kept on the session
+    itself, so that they are freed with it, when its thread ends or when
+    the caller lets go of a session of their own.
+    """
+    indigo = resolve_session(session or 'reaction')
+    compiled = getattr(indigo, '_violet_reactions', None)
+    if compiled is None:
+        compiled = indigo._violet_reactions = collections.OrderedDict()
+    rxn = compiled.pop(smarts_string, None)
+    if rxn is None:
+        rxn = Reaction(smarts_string, indigo)
+    compiled[smarts_string] = rxn
+    if len(compiled) > COMPILED_REACTIONS:
+        compiled.popitem(last=False)
+    return rxn
+
+
+def reaction(smarts_string, mol1, mol2=False, session=None):
+    """
+    This is a convenience function that quickly runs a virtual reaction
+    and return the products. The compiled reaction is cached, so repeated
+    calls with the same SMARTS string only load the reactants. session is an
+    Indigo session of your own, given the 'reaction' profile's options, or
+    'reaction'; by default this thread's 'reaction' session is used.
+
+    """
+    products = []
+    try: 
+        rxn = compiled_reaction(smarts_string, session)
+        reactants = [mol1]
+        if (mol2):
+            reactants.append(mol2)
+        products = rxn.products(*reactants[:rxn.reactant_count])
 
     except IndigoException as e:
-        print("Indigo Exception: %s" % (e))
+        logging.error("reaction(): Indigo exception: %s" % (e))
 
     except Exception as e:
-        print("Exception: %s" % (e))
+        logging.error("reaction(): Exception: %s" % (e))
 
     finally:
         return products
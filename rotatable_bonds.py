@@ -1,8 +1,121 @@
+# Core imports
+import logging
+import weakref
+
 # Third-party module imports
-import indigo as indigo_module
+from indigo import Indigo, IndigoException
+
+# Violet library imports
+from violet import instrument
+from violet.failures import from_exception
+from violet.session import load_molecule, resolve_session
+
+
+# The rotatable bond definition used by rotatable_bonds()
+ROTATABLE_BOND_SMARTS = '[!$([NH]!@C(=O))&!D1&!$(*#*)]-&!@[!$([NH]!@C(=O))&!D1&!$(*#*)]'
+
+# The ways count_rotatable_bonds() can count. 'smarts' runs the substructure
+# search, and 'graph' applies the SMARTS definition to the molecule's bonds
+# directly. The substructure search is the default: walking the bonds makes
+# several calls into Indigo per bond, which costs more than the search.
+ENGINES = ('graph', 'smarts')
+
+# The symbols of hydrogen atoms.
+HYDROGENS = ('H', 'D', 'T')
+
+# The compiled SMARTS query for each Indigo session, created on first use.
+_queries = weakref.WeakKeyDictionary()
+
+
+def _count_graph(mol):
+    """
+    Count the rotatable bonds of an aromatized molecule with one pass over
+    its bonds, as the SMARTS definition does: single, non-ring bonds
+    between atoms that have more than one heavy neighbour, no triple bond
+    and aren't an NH bonded outside a ring to a carbonyl carbon. Hydrogen
+    counts, bond orders and ring membership are Indigo's, as the substructure
+    matcher sees them.
+    """
+    # Atoms are iterated in index order.
+    symbols = [atom.symbol() for atom in mol.iterateAtoms()]
+    num_atoms = len(symbols)
+    hydrogen = [symbol in HYDROGENS for symbol in symbols]
+    heavy_degree = [0] * num_atoms
+    triple = [False] * num_atoms
+    aromatic = [False] * num_atoms
+    carbonyl = [False] * num_atoms
+    # (bond, atom, atom, bond order) for each bond. Ring membership is only
+    # looked up for the bonds that need it.
+    bonds = []
+    for bond in mol.iterateBonds():
+        a = bond.source().index()
+        b = bond.destination().index()
+        order = bond.bondOrder()
+        bonds.append((bond, a, b, order))
+        if not hydrogen[b]:
+            heavy_degree[a] += 1
+        if not hydrogen[a]:
+            heavy_degree[b] += 1
+        if order == 3:
+            triple[a] = triple[b] = True
+        elif order == 4:
+            aromatic[a] = aromatic[b] = True
+        elif order == 2:
+            if symbols[a] == 'C' and symbols[b] == 'O':
+                carbonyl[a] = True
+            elif symbols[b] == 'C' and symbols[a] == 'O':
+                carbonyl[b] = True
+
+    # Aliphatic NH atoms bonded outside a ring to an aliphatic carbonyl
+    # carbon. The hydrogens of an N are Indigo's count, implicit and
+    # explicit, so radicals and hydrogen atoms are taken into account. The
+    # SMARTS bond between them, !@, only rules out ring bonds, so it matches
+    # single and double bonds alike: the N of CCC[NH+]=C=O is excluded, so
+    # its CC-N bond isn't rotatable. Both atoms are aliphatic, so the bond
+    # can't be aromatic.
+    excluded = [hydrogen[i] or heavy_degree[i] == 1 or triple[i] for i in range(num_atoms)]
+    for bond, a, b, order in bonds:
+        if order not in (1, 2):
+            continue
+        for n, c in ((a, b), (b, a)):
+            if (symbols[n] == 'N' and not excluded[n] and not aromatic[n] and carbonyl[c] and not aromatic[c]
+                    and bond.topology() != Indigo.RING and mol.getAtom(n).countHydrogens() == 1):
+                excluded[n] = True
+
+    return sum(1 for bond, a, b, order in bonds
+               if order == 1 and not excluded[a] and not excluded[b] and bond.topology() != Indigo.RING)
+
+
+def _count_smarts(indigo, mol):
+    """
+    Count the rotatable bonds of an aromatized molecule with a substructure
+    search for ROTATABLE_BOND_SMARTS, compiled once per session.
+    """
+    query = _queries.get(indigo)
+    if query is None:
+        query = _queries[indigo] = indigo.loadSmarts(ROTATABLE_BOND_SMARTS)
+    return indigo.substructureMatcher(mol).countMatches(query)
+
+
+def count_rotatable_bonds(indigo, mol, engine='smarts', check=False):
+    """
+    Count the rotatable bonds in an aromatized Indigo molecule. See
+    rotatable_bonds() for the definition, and ENGINES for the engines.
+    With check=True the count is made with both engines, and a ValueError
+    is raised if the two differ.
+    """
+    if engine not in ENGINES:
+        raise ValueError("Unknown rotatable bond engine: %s" % (engine))
+    with instrument.stage('match'):
+        graph = _count_graph(mol) if engine == 'graph' or check else None
+        smarts = _count_smarts(indigo, mol) if engine == 'smarts' or check else None
+        if check and graph != smarts:
+            raise ValueError("Rotatable bond engines disagree for %s: graph %d, SMARTS %d"
+                             % (mol.smiles(), graph, smarts))
+        return graph if engine == 'graph' else smarts
 
 
-def rotatable_bonds(smiles):
+def rotatable_bonds(smiles, session=None, engine='smarts', check=False):
     """
     Find the number of rotatable bonds in a molecule.
     Rotatable bonds are defined as any single bond, not in a ring, bound
@@ -12,26 +125,53 @@ def rotatable_bonds(smiles):
 
     The SMARTS definition is that according to
     J. Med. Chem., 2002, 45 (12), pp 2615-2623
+
+    session is an Indigo session or the name of a session profile; by
+    default the session of the default profile for this thread is reused.
+    See count_rotatable_bonds() for engine and check; ValueError is raised
+    for an unknown engine or engines that disagree.
     """
     rotatable = 0
     try:
-        # Initialise the Indigo library
-        indigo = indigo_module.Indigo()
-        # Load the molecule into Indigo
-        try:
-            mol = indigo.loadMolecule(smiles)
-        except IndigoException as e:
-            # If loading the molecule fails, try turning off chirality error checking and try again.
-            indigo.setOption("ignore-stereochemistry-errors", True)
-            mol = indigo.loadMolecule(smiles)
+        instrument.count('molecules')
+        indigo = resolve_session(session)
+        # Load the molecule into Indigo. If loading the molecule fails, chirality error checking is turned off
+        # and it is tried again.
+        mol = load_molecule(indigo, smiles)
         # Aromatize the molecule
-        mol.aromatize()
-        matcher = indigo.substructureMatcher(mol)
-        q = indigo.loadSmarts('[!$([NH]!@C(=O))&!D1&!$(*#*)]-&!@[!$([NH]!@C(=O))&!D1&!$(*#*)]')
-        rotatable = matcher.countMatches(q)
+        with instrument.stage('aromatize'):
+            mol.aromatize()
+        rotatable = count_rotatable_bonds(indigo, mol, engine, check)
 
     except IndigoException as e:
-        print("Indigo Exception: %s" % (e))
-    finally:
-        return rotatable
+        instrument.count('failures')
+        logging.error("rotatable_bonds(): Indigo exception: %s" % (e))
+
+    return rotatable
 
+
+def rotatable_bonds_many(molecules, session=None, engine='smarts', check=False, failures=None):
+    """
+    Generate the number of rotatable bonds of each item in an iterable of
+    SMILES strings or Indigo molecules, reusing one session. Molecules
+    that can't be processed give 0, as in rotatable_bonds(), and are added
+    to failures, a list or violet.failures.FailureLog, if one is given.
+    Nothing is logged. Indigo molecules are not modified.
+    """
+    indigo = resolve_session(session)
+    for index, mol in enumerate(molecules):
+        instrument.count('molecules')
+        smiles = mol if isinstance(mol, str) else None
+        try:
+            if smiles is not None:
+                mol = load_molecule(indigo, smiles)
+            else:
+                mol = mol.clone()
+            with instrument.stage('aromatize'):
+                mol.aromatize()
+            yield count_rotatable_bonds(indigo, mol, engine, check)
+        except IndigoException as e:
+            instrument.count('failures')
+            if failures is not None:
+                failures.append(from_exception(index, index, smiles, e, 'rotatable_bonds'))
+            yield 0
@@ -0,0 +1,283 @@
+# Core imports
+import csv
+import hashlib
+import math
+import os
+import sqlite3
+import tempfile
+
+# Third-party module imports
+from indigo import IndigoException
+
+# Violet library imports
+from violet.descriptors import canonical_smiles, compute
+from violet.failures import from_exception
+from violet.session import resolve_session
+
+
+def scaffold_key(smiles):
+    """
+    Return the compact 64 bit key for a canonical scaffold SMILES string.
+    """
+    digest = hashlib.blake2b(smiles.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+def normalize(scaffold, indigo=None):
+    """
+    Return the canonical SMILES of the aromatized form of a scaffold SMILES
+    string, so that Kekule and aromatic spellings of a scaffold are the
+    same, or '' for a scaffold of None or ''.
+    """
+    if not scaffold:
+        return ''
+    indigo = resolve_session(indigo)
+    return canonical_smiles(indigo.loadMolecule(scaffold))
+
+
+class ScaffoldIndex(object):
+    """
+    Group a stream of molecules by their Murcko (or alpha) scaffold.
+
+    Scaffolds are keyed by a 64 bit hash of the canonical SMILES of their
+    aromatized form, whatever the spelling of the input (a collision is
+    vanishingly unlikely below billions of scaffolds). Counts, and member
+    IDs if member_ids is True, are buffered in memory and spilled to an
+    SQLite database whenever buffer_size molecules have been added, so
+    memory use is bounded however many molecules and scaffolds there are.
+    The database is kept at path, or in a temporary file that is removed by
+    close() if no path is given. Molecules without a ring are grouped under
+    the empty scaffold ''.
+
+    Each flush also records, in the same transaction, how many molecules
+    have been added (the position) and how many failed. An index reopened
+    from its path carries on from there, so a run that dies can be resumed
+    by skipping the first position molecules of its input; see
+    violet.jobs.run_scaffold_job().
+    """
+
+    def __init__(self, kind='murcko', path=None, member_ids=False, buffer_size=100000, indigo=None):
+        if kind not in ('murcko', 'murcko_alpha'):
+            raise ValueError("Unknown scaffold kind: %s" % (kind))
+        self.kind = kind
+        self.member_ids = member_ids
+        self.buffer_size = buffer_size
+        self.indigo = indigo
+
+        self.temporary = path is None
+        if self.temporary:
+            fd, path = tempfile.mkstemp(suffix='.sqlite')
+            os.close(fd)
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS scaffolds (key INTEGER PRIMARY KEY, smiles TEXT, count INTEGER)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS members (key INTEGER, id TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS progress (name TEXT PRIMARY KEY, value INTEGER)")
+        progress = dict(self.db.execute("SELECT name, value FROM progress"))
+
+        # Molecules added, including those whose scaffold couldn't be
+        # computed, which are also counted as failed.
+        self.position = progress.get('position', 0)
+        self.failed = progress.get('failed', 0)
+
+        # Buffered counts, scaffold SMILES and member IDs, by key.
+        self.counts = {}
+        self.smiles = {}
+        self.member_buffer = []
+        self.buffered = 0
+
+        # Normalized scaffold SMILES by given scaffold SMILES, since the last
+        # flush.
+        self.normalized = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, mol_id, smiles):
+        """
+        Compute the scaffold of a molecule given as a SMILES string and add
+        it to the index. Returns the canonical scaffold SMILES, or None if
+        the molecule couldn't be processed.
+        """
+        try:
+            # compute() exports normalized scaffolds.
+            scaffold = compute(smiles, [self.kind], self.indigo)[self.kind] or ''
+        except Exception:
+            self.add_failure()
+            return None
+        self._add(mol_id, scaffold)
+        return scaffold
+
+    def add_scaffold(self, mol_id, scaffold, failures=None):
+        """
+        Add a molecule whose scaffold SMILES is already known, for example
+        from the batch runner, in any spelling. A scaffold of None means no
+        ring. Returns the canonical scaffold SMILES, or None if the scaffold
+        couldn't be parsed, in which case the molecule is counted as failed
+        and added to failures, a list or violet.failures.FailureLog, if one
+        is given.
+        """
+        try:
+            normalized = self.normalize(scaffold)
+        except IndigoException as e:
+            if failures is not None:
+                failures.append(from_exception(self.position, mol_id, scaffold, e, 'parse'))
+            self.add_failure()
+            return None
+        self._add(mol_id, normalized)
+        return normalized
+
+    def normalize(self, scaffold):
+        """
+        Return the normalized form of a scaffold SMILES string, as
+        normalize() does, remembering it until the next flush.
+        """
+        scaffold = scaffold or ''
+        if scaffold not in self.normalized:
+            self.normalized[scaffold] = normalize(scaffold, self.indigo)
+        return self.normalized[scaffold]
+
+    def _add(self, mol_id, scaffold):
+        key = scaffold_key(scaffold)
+        if key not in self.counts:
+            self.counts[key] = 0
+            self.smiles[key] = scaffold
+        self.counts[key] += 1
+        if self.member_ids:
+            self.member_buffer.append((key, str(mol_id)))
+        self.position += 1
+        self.buffered += 1
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def add_failure(self):
+        """
+        Count a molecule whose scaffold couldn't be computed.
+        """
+        self.failed += 1
+        self.position += 1
+        self.buffered += 1
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def add_many(self, molecules):
+        """
+        Add an iterable of (id, smiles) pairs.
+        """
+        for mol_id, smiles in molecules:
+            self.add(mol_id, smiles)
+
+    def flush(self):
+        """
+        Write the buffered counts and member IDs to the database.
+        """
+        with self.db:
+            self.db.executemany(
+                "INSERT INTO scaffolds (key, smiles, count) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET count = count + excluded.count",
+                ((key, self.smiles[key], count) for key, count in self.counts.items()))
+            self.db.executemany("INSERT INTO members (key, id) VALUES (?, ?)", self.member_buffer)
+            self.db.executemany("INSERT OR REPLACE INTO progress (name, value) VALUES (?, ?)",
+                                [('position', self.position), ('failed', self.failed)])
+        self.counts = {}
+        self.smiles = {}
+        self.member_buffer = []
+        self.buffered = 0
+        self.normalized = {}
+
+    def close(self):
+        """
+        Flush the buffers and close the database, removing it if it is
+        temporary.
+        """
+        if self.db is None:
+            return
+        if self.temporary:
+            self.db.close()
+            os.remove(self.path)
+        else:
+            self.flush()
+            self.db.close()
+        self.db = None
+
+    def __len__(self):
+        """
+        Return the number of distinct scaffolds.
+        """
+        self.flush()
+        return self.db.execute("SELECT COUNT(*) FROM scaffolds").fetchone()[0]
+
+    def count(self, scaffold):
+        """
+        Return the number of molecules with a scaffold, in any spelling.
+        """
+        key = scaffold_key(self.normalize(scaffold))
+        self.flush()
+        row = self.db.execute("SELECT count FROM scaffolds WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def frequencies(self, limit=None):
+        """
+        Generate (scaffold, count) pairs, most frequent first.
+        """
+        self.flush()
+        query = "SELECT smiles, count FROM scaffolds ORDER BY count DESC, smiles"
+        if limit is not None:
+            query += " LIMIT %d" % (int(limit))
+        for row in self.db.execute(query):
+            yield row
+
+    def members(self, scaffold):
+        """
+        Generate the IDs of the molecules with a scaffold, in any spelling,
+        in the order they were added. Requires member_ids=True.
+        """
+        if not self.member_ids:
+            raise ValueError("Member IDs are not being recorded.")
+        key = scaffold_key(self.normalize(scaffold))
+        self.flush()
+        self.db.execute("CREATE INDEX IF NOT EXISTS members_key ON members (key)")
+        for row in self.db.execute("SELECT id FROM members WHERE key = ? ORDER BY rowid", (key,)):
+            yield row[0]
+
+    def diversity(self):
+        """
+        Return a dictionary of scaffold diversity statistics: the numbers of
+        molecules, failures, scaffolds and singleton scaffolds, the ratio of
+        scaffolds to molecules and the Shannon entropy of the scaffold
+        distribution in bits.
+        """
+        self.flush()
+        molecules = self.db.execute("SELECT COALESCE(SUM(count), 0) FROM scaffolds").fetchone()[0]
+        scaffolds = 0
+        singletons = 0
+        entropy = 0.0
+        for (count,) in self.db.execute("SELECT count FROM scaffolds"):
+            scaffolds += 1
+            if count == 1:
+                singletons += 1
+            p = float(count) / molecules
+            entropy -= p * math.log(p, 2)
+        return {
+            'molecules': molecules,
+            'failed': self.failed,
+            'scaffolds': scaffolds,
+            'singletons': singletons,
+            'scaffolds_per_molecule': float(scaffolds) / molecules if molecules else 0.0,
+            'entropy': entropy,
+        }
+
+    def write_frequencies(self, fn):
+        """
+        Write a CSV frequency table of scaffold and count, most frequent
+        first.
+        """
+        with open(fn, 'w') as out:
+            writer = csv.writer(out, lineterminator='\n')
+            writer.writerow(['scaffold', 'count'])
+            for row in self.frequencies():
+                writer.writerow(row)
+
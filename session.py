@@ -0,0 +1,134 @@
+# Core imports
+import os
+import re
+import threading
+import weakref
+
+# Third-party module imports
+import indigo as indigo_module
+from indigo import IndigoException
+
+# Violet library imports
+from violet import instrument
+from violet.failures import tag
+
+
+# Input that load_molecule() retries with stereochemistry errors ignored:
+# SMILES stereochemistry, or a line break, as in molfiles.
+_STEREO = re.compile(r'[@/\\\n]')
+
+# Named sets of Indigo options. A session made for a profile has its options
+# set once, when it is created, and they aren't changed afterwards, except
+# that load_molecule() briefly relaxes stereochemistry checking to retry a
+# failed load. Add an entry to define a new profile.
+PROFILES = {
+    # Indigo's defaults: stereochemistry errors stop a molecule loading.
+    'strict': {},
+    'lenient': {
+        'ignore-stereochemistry-errors': True,
+    },
+    # Generate multiple products from a reaction, without feeding products
+    # back in to be reacted a second time around. Indigo stops after 1000
+    # products per call by default, which a block of a reactant grid can
+    # easily exceed.
+    'reaction': {
+        'rpe-multistep-reactions': 'true',
+        'rpe-max-depth': '1',
+        'rpe-self-reaction': 'false',
+        'rpe-mode': 'grid',
+        'rpe-max-products-count': 1000000,
+    },
+}
+
+# The profile of the session that violet functions use by default.
+DEFAULT_PROFILE = 'strict'
+
+# The sessions of the current thread, keyed by profile name, and the
+# process they were made in.
+_local = threading.local()
+
+# The profile each session was made for.
+_profiles = weakref.WeakKeyDictionary()
+
+
+def configure(indigo, profile):
+    """
+    Set the options of a named profile on an Indigo session. A session that
+    was made for another profile can't be given a new one, since it is
+    shared by everything that uses that profile in this thread.
+    """
+    if profile not in PROFILES:
+        raise ValueError("Unknown session profile: %s" % (profile))
+    current = _profiles.get(indigo)
+    if current is not None and current != profile:
+        raise ValueError("The session of the '%s' profile can't be given the '%s' profile." % (current, profile))
+    for option, value in PROFILES[profile].items():
+        indigo.setOption(option, value)
+    _profiles[indigo] = profile
+
+
+def profile_of(indigo):
+    """
+    Return the name of the profile a session was configured for, or None.
+    """
+    return _profiles.get(indigo)
+
+
+def get(profile=DEFAULT_PROFILE):
+    """
+    Return the Indigo session for a profile, creating and configuring it the
+    first time it is asked for in this thread. Indigo sessions can't be
+    shared between threads, and a process started by forking gets sessions
+    of its own.
+    """
+    sessions = getattr(_local, 'sessions', None)
+    if sessions is None or _local.pid != os.getpid():
+        sessions = _local.sessions = {}
+        _local.pid = os.getpid()
+    indigo = sessions.get(profile)
+    if indigo is None:
+        indigo = indigo_module.Indigo()
+        configure(indigo, profile)
+        sessions[profile] = indigo
+    return indigo
+
+
+def resolve_session(session=None):
+    """
+    Return the Indigo session for a session argument, which can be an Indigo
+    session, the name of a profile, or None for the default profile.
+    """
+    if session is None:
+        return get()
+    if isinstance(session, str):
+        return get(session)
+    return session
+
+
+def load_molecule(indigo, smiles):
+    """
+    Load a SMILES string (or any other format Indigo recognises), retrying
+    with stereochemistry errors ignored if the first attempt fails. The
+    session's setting is restored afterwards, so a session's options are the
+    same after the call as before it. The exception raised if it can't be
+    loaded is tagged as a 'parse' failure.
+
+    A failed load costs Indigo about a millisecond, so the retry is only
+    made when it can help: when the session doesn't already ignore
+    stereochemistry errors, and the input is either a SMILES string with
+    stereochemistry (@, / or \\) or a multi-line format such as a molfile.
+    """
+    with instrument.stage('parse'):
+        try:
+            return indigo.loadMolecule(smiles)
+        except IndigoException as e:
+            if not _STEREO.search(smiles) or indigo.getOptionBool("ignore-stereochemistry-errors"):
+                raise tag(e, 'parse')
+            # The option was off, so it is turned off again afterwards.
+            indigo.setOption("ignore-stereochemistry-errors", True)
+            try:
+                return indigo.loadMolecule(smiles)
+            except IndigoException as e:
+                raise tag(e, 'parse')
+            finally:
+                indigo.setOption("ignore-stereochemistry-errors", False)
@@ -1,20 +1,120 @@
 # Core imports
+import array
+import collections
 import logging
 
 # Third-party module imports
 import indigo as indigo_module
+from indigo import IndigoException
 
+# Violet library imports
+from violet import instrument
+from violet.failures import from_exception
+from violet.session import load_molecule, resolve_session
 
-def sp3carbon(smiles):
+
+# The results of sp3carbon_many(), as one array per field. Molecules that
+# can't be processed have counts of -1 and a NaN fraction.
+Sp3CarbonArrays = collections.namedtuple("Sp3CarbonArrays", ["num_carbon", "num_carbon_sp3", "sp3_fraction"])
+
+
+def count_sp3carbon(mol):
+    """
+    Count the carbon atoms and sp3 hybridised carbon atoms in an aromatized
+    Indigo molecule. Returns the same (carbon, sp3 carbon, sp3 fraction)
+    tuple as sp3carbon().
+
+    A carbon atom is sp3 hybridised if it has four connections. These are
+    counted as its neighbours plus its implicit hydrogens, so the molecule's
+    hydrogens don't need to be unfolded (and it works if they have been).
+    """
+    num_carbon = 0
+    num_carbon_sp3 = 0
+    for atom in mol.iterateAtoms():
+        if (atom.atomicNumber() == 6):
+            num_carbon = num_carbon + 1
+            if (atom.degree() + atom.countImplicitHydrogens() == 4):
+                num_carbon_sp3 = num_carbon_sp3 + 1
+
+    if num_carbon == 0:
+        sp3_fraction = 0
+    else:
+        sp3_fraction = float(num_carbon_sp3) / num_carbon
+    return (num_carbon, num_carbon_sp3, sp3_fraction)
+
+
+def sp3carbon(smiles, session=None):
     """
     Calculate the number of carbon atoms, sp3 hybridised carbon atoms and sp3
-    fraction of a SMILES string.
+    fraction of a SMILES string. session is an Indigo session or the name of
+    a session profile, as for rotatable_bonds().
+    """
+
+    return_value = False
+
+    try:
+        instrument.count('molecules')
+        # If loading the molecule fails, chirality error checking is turned off and it is tried again.
+        mol = load_molecule(resolve_session(session), smiles)
+
+        with instrument.stage('aromatize'):
+            mol.aromatize()
+
+        return_value = count_sp3carbon(mol)
+
+    except IndigoException as e:
+        instrument.count('failures')
+        logging.error("sp3carbon(): Indigo exception: %s" % (e))
+    except Exception as e:
+        instrument.count('failures')
+        logging.error("sp3carbon(): Exception: %s" % (e))
+    finally:
+        return return_value
+
+
+def sp3carbon_many(molecules, session=None, failures=None):
+    """
+    Calculate sp3carbon() for each item in an iterable of SMILES strings or
+    Indigo molecules, reusing one session, and return the results as
+    compact arrays in an Sp3CarbonArrays tuple. Molecules that can't be
+    processed give -1 counts and a NaN fraction, and are added to failures,
+    a list or violet.failures.FailureLog, if one is given. Nothing is
+    logged. Indigo molecules are not modified.
+    """
+    indigo = resolve_session(session)
+    num_carbon = array.array('i')
+    num_carbon_sp3 = array.array('i')
+    sp3_fraction = array.array('d')
+    for index, mol in enumerate(molecules):
+        instrument.count('molecules')
+        smiles = mol if isinstance(mol, str) else None
+        try:
+            if smiles is not None:
+                mol = load_molecule(indigo, smiles)
+            else:
+                mol = mol.clone()
+            with instrument.stage('aromatize'):
+                mol.aromatize()
+            counts = count_sp3carbon(mol)
+        except IndigoException as e:
+            instrument.count('failures')
+            if failures is not None:
+                failures.append(from_exception(index, index, smiles, e, 'sp3carbon'))
+            counts = (-1, -1, float('nan'))
+        num_carbon.append(counts[0])
+        num_carbon_sp3.append(counts[1])
+        sp3_fraction.append(counts[2])
+    return Sp3CarbonArrays(num_carbon, num_carbon_sp3, sp3_fraction)
+
+
+def sp3carbon_reference(smiles):
+    """
+    The original implementation of sp3carbon(), which unfolds the molecule's
+    hydrogens and counts the carbon atoms with four neighbours. Kept to
+    check count_sp3carbon() against.
     """
 
     return_value = False
-    num_carbon = float(0)
-    num_carbon_sp3 = float(0)
-    sp3_fraction = float(0)
 
     try:
         indigo = indigo_module.Indigo()
@@ -28,6 +128,8 @@ def sp3carbon(smiles):
         mol.aromatize()
 
         mol.unfoldHydrogens() # Must add hydrogens to get the correct answer
+        num_carbon = 0
+        num_carbon_sp3 = 0
         for atom in mol.iterateAtoms():
             if (atom.symbol() == 'C'):
                 num_carbon = num_carbon + 1
@@ -37,8 +139,8 @@ def sp3carbon(smiles):
         if num_carbon == 0:
             sp3_fraction = 0
         else:
-            sp3_fraction = num_carbon_sp3 / num_carbon
-        return_value = (int(num_carbon), int(num_carbon_sp3), sp3_fraction)
+            sp3_fraction = float(num_carbon_sp3) / num_carbon
+        return_value = (num_carbon, num_carbon_sp3, sp3_fraction)
 
     except IndigoException as e:
         logging.error("sp3carbon(): Indigo exception: %s" % (e))
@@ -46,5 +148,3 @@ def sp3carbon(smiles):
         logging.error("sp3carbon(): Exception: %s" % (e))
     finally:
         return return_value
-
-
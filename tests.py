@@ -1,16 +1,86 @@
 # Core module imports
+import asyncio
+import contextlib
+import gc
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
 import unittest
+import weakref
 
 # Third-party module imports
 import indigo as indigo_module
+import numpy
 
 # Violet library imports
+import violet
+from violet import arrays
+from violet import instrument
 from violet import murcko
 from violet import murcko_alpha
 from violet import reaction
 from violet import rotatable_bonds
+from violet import session
 from violet import sp3carbon
 from violet import tpsa
+from violet.aio import DescriptorService
+from violet.batch import Failure, collect, run
+from violet.benchmarks import corpus as benchmark_corpus
+from violet.benchmarks import suite as benchmark_suite
+from violet.cache import DescriptorCache, LRUCache
+from violet.cli import main as cli_main
+from violet.descriptors import compute
+from violet.failures import FailureLog, quarantined
+from violet.murcko import murcko_reference
+from violet.murcko_alpha import murcko_alpha_reference, murcko_and_alpha
+from violet.incremental import refresh_file
+from violet.jobs import DescriptorJob, run_scaffold_job
+from violet.offsets import OffsetIndex
+from violet.reaction import Reaction, compiled_reaction
+from violet.rotatable_bonds import rotatable_bonds_many
+from violet.scaffolds import ScaffoldIndex, scaffold_key
+from violet.sp3carbon import sp3carbon_many, sp3carbon_reference
+from violet.tpsa import TPSACalculator
+
+
+# Ring systems and chains with one attachment point, marked {}.
+CORPUS_CORES = [
+    "c1ccc({})cc1", "c1ccnc({})c1", "c1cc({})ccn1", "c1ccc2[nH]c({})cc2c1",
+    "c1coc({})c1", "c1csc({})c1", "c1cnc({})[nH]1", "Cn1ccnc1{}",
+    "c1ccc2c(c1)ccc({})n2", "c1cc[n+]([O-])c({})c1", "C1CC1{}", "C1CN1{}",
+    "C1OC1{}", "C1CCNC({})C1", "C1COCCN1{}", "C1CCC({})CC1", "CC(C)(C){}",
+    "CCCCCCCC{}", "OC(=O)C1(O)CC1{}", "O=C1NC(=O)C({})N1", "c1ncncc1{}",
+    "N#Cc1cc({})cc(c1)N=C=O", "C1CC2CCC1C2{}", "C1CCCCCCCCCCC1{}",
+    "c1ccc2c(c1)C(=O)N({})C2=O", "O=S(=O)(N{})c1ccccc1", "CN(C)P(=O)(O{})N(C)C",
+    "C[N+](C)(C)CC{}", "C=CC{}", "C#CC{}",
+]
+
+# Substituents, written so that their first atom bonds to the core.
+CORPUS_SUBSTITUENTS = [
+    "", "C", "O", "N", "S", "Cl", "F", "C#N", "C(=O)O", "C(=O)[O-]", "C(=O)N",
+    "NC(=O)C", "N(C)C", "[NH3+]", "[NH2+]C", "[N+](C)(C)C", "[N+](=O)[O-]",
+    "N(=O)=O", "N=[N+]=[N-]", "N=C=O", "N=O", "OC", "OC(=O)C", "S(=O)(=O)N",
+    "S(=O)C", "P(=O)(O)O", "C=N", "C(=N)N", "N=C(N)N", "NN", "NO", "ON",
+    "C9CN9", "C9CO9", "n9cccc9", "n9ccnc9", "c9ccncc9", "[n+]9ccccc9",
+    "[O-]", "[OH+]C", "C(F)(F)F", "CC(=O)NC9CC9", "OCCO", "C=O",
+]
+
+
+def corpus():
+    """
+    Generate a deterministic corpus of SMILES strings by attaching each
+    substituent to each core.
+    """
+    for core in CORPUS_CORES:
+        for substituent in CORPUS_SUBSTITUENTS:
+            yield core.format(substituent).replace("()", "")
+
+
+AMIDE_FORMATION_SMARTS = "([NX3;H1,H2;!$(NC=O);!$(NS(=O)=O)]).([CX3;$([R0][#6]),$([H1R0])](=[OX1])[$([OX2H]),$([OX1-]),Cl])>>[NX3;H1;!$(NC=O);!$(NS(=O)=O)][CX3;$([R0][#6]),$([H1R0])](=[OX1])"
 
 
 class violetTests(unittest.TestCase):
@@ -21,12 +91,96 @@ class violetTests(unittest.TestCase):
         mol = indigo.loadMolecule(icb)
         self.assertEqual(murcko(mol).canonicalSmiles(),'C1C=CC=CC=1')
 
+    # Exocyclic double bonds are kept while their ring or linker atom keeps
+    # three connections.
+    def test_murcko_exocyclic(self):
+        indigo = indigo_module.Indigo()
+        mol = indigo.loadMolecule("O=C1CCC(=O)C1=CC")
+        self.assertEqual(murcko(mol).canonicalSmiles(), 'C=C1C(=O)CCC1=O')
+        mol = indigo.loadMolecule("CC(=O)C(=O)Nc1ccccc1")
+        self.assertEqual(murcko(mol).canonicalSmiles(), 'c1ccccc1')
+
+    # Molecules without a ring have no scaffold. Acyclic fragments are
+    # removed from salts.
+    def test_murcko_no_ring(self):
+        indigo = indigo_module.Indigo()
+        self.assertEqual(murcko(indigo.loadMolecule("CCCC")), None)
+        self.assertEqual(murcko(indigo.loadMolecule("C")), None)
+        self.assertEqual(murcko(indigo.loadMolecule("c1ccccc1CC(=O)[O-].[Na+]")).canonicalSmiles(), 'c1ccccc1')
+
+    # The queue-based implementation gives the same scaffolds as the
+    # original implementation over the corpus.
+    def test_murcko_equivalent(self):
+        indigo = indigo_module.Indigo()
+        for smiles in corpus():
+            mol = indigo.loadMolecule(smiles)
+            expected = murcko_reference(mol)
+            result = murcko(mol)
+            if expected is None:
+                self.assertEqual(result, None, smiles)
+            else:
+                self.assertEqual(result.canonicalSmiles(), expected.canonicalSmiles(), smiles)
+
     def test_murcko_alpha(self):
         indigo = indigo_module.Indigo()
         icb = "N#CC1C=CC=C(C=1)N=C=O" # 3-isocyanatobenzonitrile
         mol = indigo.loadMolecule(icb)
         self.assertEqual(murcko_alpha(mol).canonicalSmiles(),'CC1=CC(N)=CC=C1')
 
+    # Both frameworks can be computed together.
+    def test_murcko_and_alpha(self):
+        indigo = indigo_module.Indigo()
+        mol = indigo.loadMolecule("N#CC1C=CC=C(C=1)N=C=O")
+        framework, alpha = murcko_and_alpha(mol)
+        self.assertEqual(framework.canonicalSmiles(), 'C1C=CC=CC=1')
+        self.assertEqual(alpha.canonicalSmiles(), 'CC1=CC(N)=CC=C1')
+        self.assertEqual(murcko_and_alpha(indigo.loadMolecule("CCO")), (None, None))
+
+    # The indexed implementation gives the same alpha frameworks as the
+    # original implementation over the corpus.
+    def test_murcko_alpha_equivalent(self):
+        indigo = indigo_module.Indigo()
+        for smiles in corpus():
+            mol = indigo.loadMolecule(smiles)
+            expected = murcko_alpha_reference(mol)
+            result = murcko_alpha(mol)
+            if expected is None:
+                self.assertEqual(result, None, smiles)
+            else:
+                self.assertEqual(result.canonicalSmiles(), expected.canonicalSmiles(), smiles)
+
+    # Molecules are grouped by scaffold, with counts and members surviving
+    # spills to the database.
+    def test_scaffold_index(self):
+        molecules = [("a", "CNCc1ccccc1"), ("b", "Oc1ccccc1"), ("c", "CCO"),
+                     ("d", "C1CCCCC1C(=O)O"), ("e", "c1ccccc1CCN"), ("f", "C1CC")]
+        with ScaffoldIndex(member_ids=True, buffer_size=2) as index:
+            index.add_many(molecules)
+            self.assertEqual(len(index), 3)
+            self.assertEqual(list(index.frequencies()), [('c1ccccc1', 3), ('', 1), ('C1CCCCC1', 1)])
+            self.assertEqual(index.count('c1ccccc1'), 3)
+            self.assertEqual(list(index.members('c1ccccc1')), ['a', 'b', 'e'])
+            stats = index.diversity()
+            self.assertEqual((stats['molecules'], stats['failed'], stats['scaffolds'], stats['singletons']), (5, 1, 3, 2))
+            self.assertAlmostEqual(stats['entropy'], 1.371, places=3)
+
+        # Kekule and aromatic spellings of a scaffold are grouped together.
+        with ScaffoldIndex(member_ids=True) as index:
+            index.add_many([("a", "c1ccccc1CC"), ("b", "C1=CC=CC=C1CCC"), ("c", "Oc1ccccc1")])
+            index.add_scaffold("d", "C1C=CC=CC=1")
+            self.assertEqual(list(index.frequencies()), [('c1ccccc1', 4)])
+            self.assertEqual(index.count('C1=CC=CC=C1'), 4)
+            self.assertEqual(list(index.members('C1=CC=CC=C1')), ['a', 'b', 'c', 'd'])
+
+        # A scaffold that won't parse is counted as a failure.
+        with ScaffoldIndex() as index:
+            failures = []
+            self.assertEqual(index.add_scaffold("a", "c1ccccc1"), "c1ccccc1")
+            self.assertIsNone(index.add_scaffold("b", "C1CC", failures))
+            self.assertEqual([(f.index, f.id, f.smiles, f.function) for f in failures], [(1, "b", "C1CC", "parse")])
+            stats = index.diversity()
+            self.assertEqual((stats['molecules'], stats['failed'], stats['scaffolds']), (1, 1, 1))
+
     # Bimolecular reaction: Amide formation
     def test_reaction_bimolecular(self):
         amide_formation_smarts = "([NX3;H1,H2;!$(NC=O);!$(NS(=O)=O)]).([CX3;$([R0][#6]),$([H1R0])](=[OX1])[$([OX2H]),$([OX1-]),Cl])>>[NX3;H1;!$(NC=O);!$(NS(=O)=O)][CX3;$([R0][#6]),$([H1R0])](=[OX1])"
@@ -53,6 +207,81 @@ class violetTests(unittest.TestCase):
         mol = "C1CCCCC1N"
         self.assertEqual(reaction(boc_deprotection_smarts, mol), [])
 
+    # A compiled reaction enumerates the grid of two reactant pools,
+    # skipping reactants that don't match their template.
+    def test_reaction_enumerate(self):
+        rxn = Reaction(AMIDE_FORMATION_SMARTS)
+        amines = ["CN", "CCN", "c1ccccc1", "C1CCNCC1"]
+        acids = ["CC(=O)Cl", "OC(=O)c1ccccc1", "CC(C)=O"]
+        products = list(rxn.enumerate([amines, acids], chunk_size=2))
+        self.assertEqual(sorted(products), sorted([
+            'CNC(C)=O', 'CNC(=O)C1C=CC=CC=1', 'CCNC(C)=O', 'CCNC(=O)C1C=CC=CC=1',
+            'CC(=O)N1CCCCC1', 'O=C(C1C=CC=CC=1)N1CCCCC1']))
+        self.assertEqual(list(rxn.enumerate([amines, acids], chunk_size=3, jobs=2)), products)
+        self.assertEqual(len(list(rxn.enumerate([amines, acids], limit=4))), 4)
+        many = ["C" * n + "N" for n in range(1, 41)]
+        acyl_chlorides = ["C" * n + "C(=O)Cl" for n in range(1, 31)]
+        self.assertEqual(len(list(rxn.enumerate([many, acyl_chlorides], chunk_size=40))), 1200)
+        self.assertEqual(list(rxn.enumerate([["CN", "CN"], ["CC(=O)Cl"]], unique=True)), ['CNC(C)=O'])
+
+    # The prescreen only enumerates reactants that match one of the
+    # reaction's templates, and reports the others.
+    def test_reaction_prescreen(self):
+        rxn = Reaction(AMIDE_FORMATION_SMARTS)
+        amines = ["CN", "c1ccccc1", "not a smiles", "C1CCNCC1"]
+        acids = ["CC(C)=O", "CC(=O)Cl"]
+        screened = rxn.prescreen([amines, acids])
+        self.assertEqual(screened.smiles, [["CN", "C1CCNCC1"], ["CC(=O)Cl"]])
+        self.assertEqual([(r.slot, r.index, r.reason) for r in screened.rejects],
+                         [(0, 1, "template"), (0, 2, "parse"), (1, 0, "template")])
+        rejects = []
+        products = list(rxn.enumerate([amines, acids], prescreen=True, rejects=rejects))
+        self.assertEqual(sorted(products), ['CC(=O)N1CCCCC1', 'CNC(C)=O'])
+        self.assertEqual(rejects, screened.rejects)
+        self.assertEqual(sorted(rxn.enumerate([amines, acids])), sorted(products))
+        # A reactant in the other pool can still fill the slot it matches.
+        self.assertEqual(rxn.prescreen([["CC(=O)Cl"], ["CN"]]).rejects, [])
+
+    # A reactant that makes Indigo raise is rejected, without losing the
+    # products of the rest of its block, and a block that reaches the
+    # product limit of a call is split.
+    def test_reaction_enumerate_recovers(self):
+        rxn = Reaction("[n;H1:1]>>[n:1]C")
+        pool = ["c1ccc[nH]1", "c1cnc[nH]1", "CC", "c1ccc2[nH]ccc2c1"]
+        for jobs in (1, 2):
+            rejects = []
+            products = list(rxn.enumerate([pool + ["not a smiles"]], jobs=jobs, rejects=rejects))
+            self.assertEqual(products, ["CN1C=CC=C1", "CN1C=CC2=CC=CC=C12"])
+            self.assertEqual([(r.index, r.reason) for r in rejects], [(4, "parse"), (1, "react")])
+        module = sys.modules["violet.reaction"]
+        limit = module.MAX_PRODUCTS_PER_CALL
+        rxn = Reaction("[C:1]=O>>[C:1]O")
+        aldehydes = ["CC=O", "CCC=O", "CCCC=O"]
+        try:
+            module.MAX_PRODUCTS_PER_CALL = 2
+            self.assertEqual(list(rxn.enumerate([aldehydes])), ["CCO", "CCCO", "CCCCO"])
+        finally:
+            module.MAX_PRODUCTS_PER_CALL = limit
+
+    # The order of the reactants given to reaction() doesn't matter.
+    def test_reaction_reactant_order(self):
+        self.assertEqual(reaction(AMIDE_FORMATION_SMARTS, "OC(=O)c1ccccc1", "C1CCNCC1"), ['O=C(C1C=CC=CC=1)N1CCCCC1'])
+        self.assertEqual(reaction(AMIDE_FORMATION_SMARTS, "CC(=O)Cl", "C1CCNCC1"), ['CC(=O)N1CCCCC1'])
+        self.assertEqual(reaction(AMIDE_FORMATION_SMARTS, "C1CCNCC1", "CC(=O)Cl"), ['CC(=O)N1CCCCC1'])
+
+    # Repeated BOC deprotection reacts each intermediate once, breadth first.
+    def test_reaction_multistep(self):
+        boc_deprotection_smarts = "[*;$([NX3]([C,N,O])([CX4])C(=O)OC(C)(C)C):1]C(=O)OC(C)(C)C>>[*:1]"
+        rxn = Reaction(boc_deprotection_smarts)
+        boc3 = "CN(C(=O)OC(C)(C)C)C1CCN(C(=O)OC(C)(C)C)CC1N(C)C(=O)OC(C)(C)C"
+        result = rxn.multistep([boc3], max_depth=5)
+        self.assertEqual(result.stopped, 'exhausted')
+        self.assertEqual([depth for depth, smiles in result.products], [1, 1, 1, 2, 2, 2, 3])
+        self.assertEqual(result.products[-1], (3, 'CNC1CCNCC1NC'))
+        self.assertEqual([s.new for s in result.stats], [3, 3, 1, 0])
+        self.assertEqual(rxn.multistep([boc3], max_depth=1).stopped, 'max_depth')
+        self.assertEqual(len(rxn.multistep([boc3], max_products=4).products), 4)
+
     # Calculate the number of rotatable bonds for benzene. The answer should be zero.
     def test_rotatable_bonds_0(self):
         self.assertEqual(rotatable_bonds("c1ccccc1"), 0)
@@ -61,6 +290,25 @@ class violetTests(unittest.TestCase):
     def test_rotatable_bonds_2(self):
         self.assertEqual(rotatable_bonds("C(C)C(C)CC"), 2)
 
+    # The graph engine counts the same bonds as the SMARTS definition,
+    # including secondary amides, which are excluded, and tertiary amides,
+    # radical amide nitrogens and NH2 amide nitrogens, which aren't.
+    # Checking raises ValueError if the engines disagree.
+    def test_rotatable_bonds_graph(self):
+        smiles = list(corpus()) + ["CC(=O)NCC", "CC(=O)N(C)CC", "CC#CCC", "C[NH2+]CC(=O)[O-]",
+                                   "C[N]C(=O)C", "CC[N]C(=O)CC", "CC[NH]([H])C(=O)CC", "CC(=O)N([H])C", "[H]OCC"]
+        counts = list(rotatable_bonds_many(smiles, engine="graph", check=True))
+        self.assertEqual(counts, list(rotatable_bonds_many(smiles)))
+        self.assertEqual(counts[-9:], [0, 2, 0, 2, 1, 3, 3, 0, 0])
+        # Amidines and imines, including an NH double bonded to a carbonyl
+        # carbon, which the SMARTS bond !@ matches.
+        imines = ["CC(=O)C(=N)NCC", "CCNC(=N)C", "CCCN=C=O", "CCC[NH+]=C=O", "CCC(=O)[NH+]=CC"]
+        self.assertEqual(list(rotatable_bonds_many(imines, engine="graph", check=True)), [3, 2, 2, 1, 1])
+        # The public function raises rather than hiding bad engines and
+        # disagreements.
+        self.assertEqual(rotatable_bonds("CCC[NH+]=C=O", engine="graph", check=True), 1)
+        self.assertRaises(ValueError, rotatable_bonds, "CCCC", engine="no such engine")
+
     # There are no carbon atoms in sulfamoyl chloride, so the answer should contain zeros.
     def test_sp3carbon_nocarbons(self):
         self.assertEqual(sp3carbon("NS(=O)(=O)Cl"), (0, 0, 0))
@@ -77,6 +325,443 @@ class violetTests(unittest.TestCase):
     def test_sp3carbon_2(self):
         self.assertEqual(sp3carbon("CNCc1ccccc1"), (8, 2, 0.25))
 
+    # Counting implicit hydrogens gives exactly what unfolding them does,
+    # and the batch API returns the same values as arrays.
+    def test_sp3carbon_equivalent(self):
+        smiles = list(corpus()) + ["[CH3-]", "[CH2]", "C[C+](C)C", "[2H]C([2H])([2H])[2H]"]
+        expected = [sp3carbon_reference(s) for s in smiles]
+        self.assertEqual([sp3carbon(s) for s in smiles], expected)
+        arrays = sp3carbon_many(smiles + ["not a smiles"])
+        self.assertEqual(list(zip(*arrays))[:-1], [tuple(e) for e in expected])
+        self.assertEqual((arrays.num_carbon[-1], arrays.num_carbon_sp3[-1]), (-1, -1))
+
+    # Computing several descriptors at once gives the same values as the
+    # individual functions.
+    def test_compute_record(self):
+        smiles = "N#CC1C=CC=C(C=1)N=C=O"
+        record = compute(smiles)
+        self.assertEqual(list(record), ['tpsa', 'rotatable_bonds', 'sp3carbon', 'murcko', 'murcko_alpha'])
+        self.assertEqual(record['tpsa'], tpsa(smiles))
+        self.assertEqual(record['rotatable_bonds'], rotatable_bonds(smiles))
+        self.assertEqual(record['sp3carbon'], sp3carbon(smiles))
+        self.assertEqual(record['murcko'], 'c1ccccc1')
+        self.assertEqual(record['murcko_alpha'], 'Cc1cc(N)ccc1')
+
+    # Only the requested descriptors are computed.
+    def test_compute_subset(self):
+        record = compute("CNCc1ccccc1", descriptors=['sp3carbon', 'murcko'])
+        self.assertEqual(dict(record), {'sp3carbon': (8, 2, 0.25), 'murcko': 'c1ccccc1'})
+        self.assertEqual(compute("CCO", descriptors=['murcko_alpha'])['murcko_alpha'], None)
+
+    # The process pool gives the same records as compute(), in input order,
+    # and reports molecules that can't be loaded as failures.
+    def test_batch_pool(self):
+        smiles = list(corpus())[:200]
+        molecules = [("mol%d" % i, s) for i, s in enumerate(smiles)] + [("bad", "C1CC")]
+        results, failures = collect(molecules, descriptors=['tpsa', 'sp3carbon'], jobs=2, chunk_size=16)
+        self.assertEqual([r.id for r in results], ["mol%d" % i for i in range(len(smiles))])
+        self.assertEqual(results[7].values, compute(smiles[7], descriptors=['tpsa', 'sp3carbon']))
+        self.assertEqual([(f.index, f.id) for f in failures], [(len(smiles), "bad")])
+
+    # Unordered output contains every molecule exactly once.
+    def test_batch_unordered(self):
+        smiles = list(corpus())[:100]
+        outcomes = list(run(smiles, descriptors=['rotatable_bonds'], jobs=2, chunk_size=7, ordered=False))
+        self.assertEqual(sorted(o.index for o in outcomes), list(range(len(smiles))))
+        self.assertFalse(any(isinstance(o, Failure) for o in outcomes))
+
+    # Concurrent requests to the asyncio service are batched, and each gets
+    # its own values, or the exception raised for its molecule.
+    def test_descriptor_service(self):
+        smiles = list(corpus())[:50]
+
+        async def requests():
+            async with DescriptorService(workers=2, processes=False, max_batch=8, max_pending=16) as service:
+                records = await service.compute_many(smiles + ["C1CC"], ['tpsa', 'sp3carbon'])
+                scaffold = await service.murcko("CNCc1ccccc1")
+                count = await service.rotatable_bonds("CCCC", timeout=30)
+            return records, scaffold, count
+
+        records, scaffold, count = asyncio.run(requests())
+        self.assertEqual(records[:-1], [compute(s, ['tpsa', 'sp3carbon']) for s in smiles])
+        self.assertIsInstance(records[-1], indigo_module.IndigoException)
+        self.assertEqual((scaffold, count), ("c1ccccc1", 1))
+
+        async def in_processes():
+            async with DescriptorService(workers=2, max_batch=4) as service:
+                return await service.compute_many(smiles[:10] + ["C1CC"], ['tpsa'])
+
+        records = asyncio.run(in_processes())
+        self.assertEqual(records[:-1], [compute(s, ['tpsa']) for s in smiles[:10]])
+        self.assertIsInstance(records[-1], indigo_module.IndigoException)
+
+        # Closing the service settles every request, including one that the
+        # dispatcher holds while it waits for a free worker.
+        async def closed():
+            service = DescriptorService(workers=1, processes=False, max_batch=1)
+            await service.start()
+            tasks = [asyncio.ensure_future(service.tpsa(s)) for s in smiles[:3]]
+            # Let the dispatcher send the first request and take the second.
+            for _ in range(5):
+                await asyncio.sleep(0)
+            await service.close()
+            return await asyncio.wait_for(asyncio.gather(*tasks, return_exceptions=True), 10)
+
+        outcomes = asyncio.run(closed())
+        self.assertTrue(all(isinstance(o, (float, asyncio.CancelledError)) for o in outcomes))
+
+    # Failures are reported as records naming the function and error that
+    # failed them, counted, and quarantined without printing anything.
+    def test_failure_log(self):
+        caffeine = "Cn1cnc2c1c(=O)n(C)c(=O)n2C"
+        molecules = [("ok", "CCO"), ("bad", "C1CC"), ("caffeine", caffeine)]
+        results, failures = collect(molecules, descriptors=["rotatable_bonds", "tpsa"], jobs=1)
+        self.assertEqual([(f.id, f.function, f.error_class) for f in failures],
+                         [("bad", "parse", "IndigoException"), ("caffeine", "tpsa", "IndigoException")])
+        self.assertTrue(failures[0].error.startswith("IndigoException: "))
+        fd, fn = tempfile.mkstemp(suffix=".jsonl")
+        os.close(fd)
+        try:
+            with FailureLog(fn) as log, contextlib.redirect_stdout(io.StringIO()) as printed:
+                for failure in failures:
+                    log.append(failure)
+                self.assertEqual(list(rotatable_bonds_many(["CC", "C1CC"], failures=log)), [0, 0])
+                self.assertEqual(len(sp3carbon_many(["not a smiles"], failures=log).num_carbon), 1)
+            self.assertEqual(printed.getvalue(), "")
+            self.assertEqual(log.stats()["by_error"], {"parse/IndigoException": 3, "tpsa/IndigoException": 1})
+            self.assertEqual(list(quarantined(fn))[:2], failures)
+            self.assertEqual([f.function for f in quarantined(fn)][2:], ["parse", "parse"])
+        finally:
+            os.remove(fn)
+
+    # Batch results can be written into a structured array, or a memory
+    # mapped .npy file, with molecules that fail marked invalid.
+    def test_compute_array(self):
+        smiles = ["CNCc1ccccc1", "not a smiles", "CCO"]
+        out, failures = arrays.compute_array(smiles)
+        self.assertEqual([f.index for f in failures], [1])
+        self.assertEqual(list(out["valid"]), [True, False, True])
+        self.assertEqual(list(out["rotatable_bonds"]), [2, -1, 0])
+        self.assertEqual(out["num_carbon"][0], 8)
+        self.assertEqual(out["murcko"][0], scaffold_key("c1ccccc1"))
+        self.assertEqual(out["murcko"][2], scaffold_key(""))
+        self.assertRaises(ValueError, arrays.compute_array, smiles, ["tpsa"], count=2)
+        self.assertRaises(ValueError, arrays.compute_array, iter(smiles), ["tpsa"], count=2)
+        self.assertRaises(ValueError, arrays.fill, arrays.allocate(3, ["tpsa"]), smiles, ["tpsa"], start=1)
+        fd, fn = tempfile.mkstemp(suffix=".npy")
+        os.close(fd)
+        try:
+            arrays.compute_array(iter(smiles), ["tpsa", "sp3carbon"], path=fn)
+            saved = numpy.load(fn, mmap_mode="r")
+            self.assertEqual(saved.dtype.names, ("valid", "tpsa", "num_carbon", "num_carbon_sp3", "sp3_fraction"))
+            self.assertAlmostEqual(saved["tpsa"][0], 12.03)
+            self.assertTrue(numpy.isnan(saved["tpsa"][1]))
+            del saved
+        finally:
+            os.remove(fn)
+
+    # The LRU cache evicts the least recently used entry when it is full.
+    def test_lru_cache(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.put("c", 3)
+        self.assertIsNone(cache.get("b", None))
+        self.assertEqual(cache.stats(), {"size": 2, "maxsize": 2, "hits": 1, "misses": 1, "evictions": 1})
+
+    # Cached values are keyed by canonical SMILES, so the Kekule spelling of
+    # a molecule reuses the values of its aromatic spelling, and they survive
+    # in the persistent cache when the process ends.
+    def test_descriptor_cache(self):
+        fd, fn = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        try:
+            with DescriptorCache(path=fn) as cache:
+                expected = cache.compute("CNCc1ccccc1")
+                self.assertEqual(cache.compute("CNCC1=CC=CC=C1"), expected)
+                self.assertEqual(cache.stats()["hits"], len(expected))
+            with DescriptorCache(path=fn) as cache:
+                self.assertEqual(cache.compute("CNCc1ccccc1"), expected)
+                self.assertEqual(cache.stats()["persistent"]["hits"], len(expected))
+            self.assertEqual(compute("CNCc1ccccc1"), expected)
+            results, failures = collect(["CNCc1ccccc1"] * 3, jobs=1, cache_size=10, cache_path=fn)
+            self.assertEqual([r.values for r in results], [expected] * 3)
+        finally:
+            os.remove(fn)
+
+    # Cached records don't depend on which spelling of a molecule was seen
+    # first.
+    def test_descriptor_cache_spelling(self):
+        spellings = ["CNCc1ccccc1", "CNCC1=CC=CC=C1"]
+        for order in (spellings, spellings[::-1]):
+            cache = DescriptorCache()
+            for smiles in order:
+                self.assertEqual(cache.compute(smiles), compute(smiles))
+        self.assertEqual(compute(spellings[0]), compute(spellings[1]))
+
+    # The benchmark suite times a function over the bundled corpus, and
+    # flags a run that is slower than its baseline.
+    def test_benchmark_compare(self):
+        pairs = benchmark_corpus.load()
+        self.assertEqual(pairs, list(benchmark_corpus.generate()))
+        results = benchmark_suite.run(["tpsa"], pairs[:20], repeat=1, isolate=False)
+        self.assertEqual(results["benchmarks"]["tpsa"]["calls"], 20)
+        self.assertEqual(benchmark_suite.compare(results, results), [])
+        slower = json.loads(json.dumps(results))
+        slower["benchmarks"]["tpsa"]["p50_us"] *= 2
+        self.assertEqual([(r.benchmark, r.metric) for r in benchmark_suite.compare(results, slower)],
+                         [("tpsa", "p50_us")])
+
+    # Importing the package imports no submodules, and using a function
+    # imports only what its module needs.
+    def test_lazy_package(self):
+        code = ("import sys, violet; before = sorted(m for m in sys.modules if m.startswith('violet')); "
+                "from violet import tpsa; print(before, tpsa('CCO') > 0, 'violet.murcko' in sys.modules)")
+        output = subprocess.check_output([sys.executable, "-c", code]).decode().strip()
+        self.assertEqual(output, "['violet'] True False")
+
+        # Every other submodule can be used as an attribute of the package.
+        package = os.path.dirname(os.path.abspath(violet.__file__))
+        names = {os.path.splitext(name)[0] for name in os.listdir(package)
+                 if name.endswith(".py") or os.path.exists(os.path.join(package, name, "__init__.py"))}
+        names -= {"__init__", "__main__", "tests"} | set(violet.__all__)
+        self.assertEqual(names, set(violet._SUBMODULES))
+        for name in names:
+            self.assertEqual(getattr(violet, name).__name__, "violet." + name)
+
+    # Instrumentation records the time spent in each stage and counts the
+    # molecules processed, only while it is enabled.
+    def test_instrument_recording(self):
+        finished = []
+        with instrument.recording(lambda name, seconds: finished.append(name)) as stats:
+            collect(["CNCc1ccccc1", "not a smiles"], descriptors=["tpsa", "murcko"], jobs=1)
+        self.assertFalse(instrument.enabled)
+        self.assertEqual(stats["counters"], {"molecules": 2, "failures": 1})
+        self.assertEqual(stats["stages"]["parse"]["calls"], 2)
+        for name in ["dearomatize", "match", "murcko", "canonical_smiles", "descriptor:tpsa"]:
+            self.assertEqual(stats["stages"][name]["calls"], 1)
+        self.assertEqual(sorted(set(finished)), sorted(stats["stages"]))
+        compute("CNCc1ccccc1")
+        self.assertEqual(instrument.snapshot(), stats)
+
+    # Each thread gets one session per profile, configured once, and a
+    # lenient retry of a failed load leaves the session's options as they
+    # were.
+    def test_session_profiles(self):
+        strict = session.get()
+        self.assertIs(session.get("strict"), strict)
+        self.assertIsNot(session.get("lenient"), strict)
+        others = []
+        thread = threading.Thread(target=lambda: others.append(session.get()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(others[0], strict)
+
+        bad_stereo = "C[C@H]=O"
+        self.assertTrue(session.load_molecule(strict, bad_stereo))
+        self.assertRaises(indigo_module.IndigoException, strict.loadMolecule, bad_stereo)
+        self.assertTrue(session.get("lenient").loadMolecule(bad_stereo))
+        self.assertEqual(rotatable_bonds("CCCC", session="lenient"), 1)
+        self.assertEqual(sp3carbon("CCO", session=strict), (2, 2, 1.0))
+        self.assertRaises(ValueError, session.get, "no such profile")
+
+        # Reactions don't relabel the session of another profile, and a
+        # failed retry restores the option a session of your own had.
+        self.assertRaises(ValueError, Reaction, "[C:1]=O>>[C:1]O", "lenient")
+        self.assertEqual(reaction("[C:1]=O>>[C:1]O", "CC=O", session="lenient"), [])
+        self.assertEqual(session.profile_of(session.get("lenient")), "lenient")
+        self.assertRaises(indigo_module.IndigoException, session.load_molecule, session.get("lenient"), "C[C@H]1CC")
+        self.assertTrue(session.get("lenient").loadMolecule(bad_stereo))
+        own = indigo_module.Indigo()
+        for ignore in (False, True):
+            own.setOption("ignore-stereochemistry-errors", ignore)
+            self.assertRaises(indigo_module.IndigoException, session.load_molecule, own, "C[C@H]1CC")
+            self.assertEqual(own.getOptionBool("ignore-stereochemistry-errors"), ignore)
+        self.assertEqual(Reaction("[C:1]=O>>[C:1]O", own).products("CC=O"), ["CCO"])
+        self.assertEqual(session.profile_of(own), "reaction")
+
+        # Compiled reactions are cached per session, and freed with it.
+        self.assertIs(compiled_reaction("[C:1]=O>>[C:1]O", own), compiled_reaction("[C:1]=O>>[C:1]O", own))
+        self.assertEqual(reaction("[C:1]=O>>[C:1]O", "CC=O", session=own), ["CCO"])
+        freed = weakref.ref(own)
+        del own
+        gc.collect()
+        self.assertIsNone(freed())
+
+    # The offset index gives random access to the records of a file, saved
+    # next to it, and its shards cover the file exactly once.
+    def test_offset_index(self):
+        fd, fn = tempfile.mkstemp(suffix=".smi")
+        with os.fdopen(fd, "w") as smi:
+            smi.write("CCO ethanol\n\nc1ccccc1\nCCN ethylamine\nCCCl")
+        try:
+            index = OffsetIndex.open(fn)
+            self.assertEqual(len(index), 4)
+            self.assertEqual(index.record(3), ("4", "CCCl"))
+            self.assertEqual(list(index.records(1, 3)), [("2", "c1ccccc1"), ("ethylamine", "CCN")])
+            shards = [list(index.iterate_shard(k, 3)) for k in range(3)]
+            self.assertEqual(sum(shards, []), list(index.records()))
+            index.close()
+            self.assertEqual(list(OffsetIndex.load(fn).offsets), list(index.offsets))
+            out = io.StringIO()
+            cli_main([fn, "-d", "rotatable_bonds", "--shard", "1/2"], stdout=out)
+            self.assertEqual(out.getvalue().splitlines(), ["id,rotatable_bonds", "ethylamine,0", "4,0"])
+            # The shards give the same IDs as reading the whole file.
+            whole = io.StringIO()
+            cli_main([fn, "-d", "rotatable_bonds"], stdout=whole)
+            sharded = ["id,rotatable_bonds"]
+            for k in range(2):
+                out = io.StringIO()
+                cli_main([fn, "-d", "rotatable_bonds", "--shard", "%d/2" % k], stdout=out)
+                sharded.extend(out.getvalue().splitlines()[1:])
+            self.assertEqual(sharded, whole.getvalue().splitlines())
+            self.assertEqual([line.split(",")[0] for line in sharded[1:]], ["ethanol", "2", "ethylamine", "4"])
+        finally:
+            os.remove(fn)
+            os.remove(fn + ".vidx")
+
+        indigo = indigo_module.Indigo()
+        fd, fn = tempfile.mkstemp(suffix=".sdf")
+        with os.fdopen(fd, "w") as sdf:
+            for smiles in ["CCO", "c1ccccc1"]:
+                mol = indigo.loadMolecule(smiles)
+                mol.setName(smiles)
+                sdf.write(mol.molfile() + "$$$$\n")
+        try:
+            index = OffsetIndex.build(fn)
+            title, molfile = index.record(1)
+            self.assertEqual(title, "c1ccccc1")
+            self.assertEqual(indigo.loadMolecule(molfile).canonicalSmiles(), "c1ccccc1")
+            index.close()
+        finally:
+            os.remove(fn)
+
+    # A job that dies resumes from its last checkpoint, without duplicating
+    # or losing any molecules.
+    def test_resumable_jobs(self):
+        smiles = [("m%d" % i, s) for i, s in enumerate(list(corpus())[:45])] + [("bad", "not a smiles")]
+
+        def dies_after(n):
+            for i, pair in enumerate(smiles):
+                if i == n:
+                    raise RuntimeError("killed")
+                yield pair
+
+        fd, fn = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        try:
+            with DescriptorJob(fn, ["tpsa", "sp3carbon"], checkpoint_every=10) as job:
+                self.assertRaises(RuntimeError, job.run, dies_after(25), chunk_size=5)
+            with DescriptorJob(fn, ["tpsa", "sp3carbon"], checkpoint_every=10) as job:
+                self.assertEqual(job.done, 20)
+                self.assertEqual(job.run(smiles), len(smiles))
+                results = list(job.results())
+                self.assertEqual([r[0] for r in results], list(range(len(smiles) - 1)))
+                self.assertEqual(results[3][2], json.loads(json.dumps(compute(smiles[3][1], ["tpsa", "sp3carbon"]))))
+                self.assertEqual([f[1] for f in job.failures()], ["bad"])
+            self.assertRaises(ValueError, DescriptorJob, fn, ["tpsa"])
+        finally:
+            os.remove(fn)
+
+        # Plain SMILES strings are numbered from the start of the input.
+        fd, fn = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        try:
+            with DescriptorJob(fn, ["tpsa"], checkpoint_every=2) as job:
+                self.assertRaises(RuntimeError, job.run, (s for _, s in dies_after(3)), chunk_size=1)
+            with DescriptorJob(fn, ["tpsa"], checkpoint_every=2) as job:
+                self.assertEqual(job.done, 2)
+                job.run([s for _, s in smiles[:6]])
+                self.assertEqual([r[1] for r in job.results()], ['0', '1', '2', '3', '4', '5'])
+        finally:
+            os.remove(fn)
+
+        fd, fn = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        try:
+            self.assertRaises(RuntimeError, run_scaffold_job, fn, dies_after(25), checkpoint_every=10)
+            with run_scaffold_job(fn, smiles, checkpoint_every=10) as index:
+                stats = index.diversity()
+            with ScaffoldIndex() as expected:
+                expected.add_many(smiles)
+                self.assertEqual(stats, expected.diversity())
+        finally:
+            os.remove(fn)
+
+    # A refresh only computes added and changed structures, recognizing a
+    # molecule written differently by its canonical SMILES, and drops
+    # molecules that have been removed.
+    def test_incremental_refresh(self):
+        week1 = [("a", "CNCc1ccccc1"), ("b", "CCO"), ("c", "OC(=O)C1(O)CC1"), ("d", "c1ccncc1")]
+        week2 = [("a", "CNCc1ccccc1"), ("b", "CCN"), ("d", "C1=CC=NC=C1"), ("e", "CCCC"), ("f", "C1CC")]
+        fd, fn = tempfile.mkstemp(suffix=".jsonl")
+        os.close(fd)
+        os.remove(fn)
+        try:
+            stats, failures = refresh_file(fn, week1, descriptors=["tpsa", "sp3carbon"])
+            self.assertEqual((stats["computed"], stats["unchanged"], stats["previous"]), (4, 0, 0))
+            stats, failures = refresh_file(fn, week2, descriptors=["tpsa", "sp3carbon"], jobs=2, chunk_size=2)
+            self.assertEqual((stats["computed"], stats["unchanged"], stats["failed"]), (2, 2, 1))
+            self.assertEqual([f.id for f in failures], ["f"])
+            with open(fn) as fh:
+                records = [json.loads(line) for line in fh]
+            self.assertEqual([r["id"] for r in records], ["a", "b", "d", "e"])
+            expected = json.loads(json.dumps(compute("CCN", ["tpsa", "sp3carbon"])))
+            self.assertEqual((records[1]["tpsa"], records[1]["sp3carbon"]), (expected["tpsa"], expected["sp3carbon"]))
+            self.assertAlmostEqual(records[2]["tpsa"], 12.89, places=2)
+            # Asking for another descriptor recomputes everything.
+            stats, failures = refresh_file(fn, week2[:4], descriptors=["tpsa", "rotatable_bonds"])
+            self.assertEqual((stats["computed"], stats["unchanged"]), (4, 0))
+            # Reused scaffolds are the same as those of the new spelling.
+            scaffolds = ["murcko", "murcko_alpha"]
+            refresh_file(fn, week1, descriptors=scaffolds)
+            stats, failures = refresh_file(fn, week2[:4], descriptors=scaffolds)
+            self.assertEqual(stats["unchanged"], 2)
+            with open(fn) as fh:
+                records = [json.loads(line) for line in fh]
+            self.assertEqual([{name: r[name] for name in scaffolds} for r in records],
+                             [dict(compute(smiles, scaffolds)) for _, smiles in week2[:4]])
+        finally:
+            os.remove(fn)
+
+    # The command line interface writes one CSV row per molecule, splitting
+    # tuple values into columns.
+    def test_cli_csv(self):
+        fd, fn = tempfile.mkstemp(suffix=".smi")
+        with os.fdopen(fd, "w") as smi:
+            smi.write("CNCc1ccccc1 bma\nc1ccccc1\n")
+        try:
+            out = io.StringIO()
+            cli_main([fn, "-d", "tpsa,sp3carbon"], stdout=out)
+        finally:
+            os.remove(fn)
+        self.assertEqual(out.getvalue().splitlines(), [
+            "id,tpsa,num_carbon,num_carbon_sp3,sp3_fraction",
+            "bma,12.03,8,2,0.25",
+            "2,0.0,6,0,0.0"])
+
+    # SD files are read record by record and can be written as JSON lines.
+    def test_cli_sdf_jsonl(self):
+        indigo = indigo_module.Indigo()
+        fd, fn = tempfile.mkstemp(suffix=".sdf")
+        os.close(fd)
+        try:
+            saver = indigo.writeFile(fn)
+            for name, smiles in [("ethanol", "CCO"), ("phenol", "Oc1ccccc1")]:
+                mol = indigo.loadMolecule(smiles)
+                mol.setName(name)
+                saver.sdfAppend(mol)
+            saver.close()
+            out = io.StringIO()
+            cli_main([fn, "-o", "jsonl", "-d", "rotatable_bonds,murcko", "-j", "2"], stdout=out)
+        finally:
+            os.remove(fn)
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(records, [
+            {"id": "ethanol", "rotatable_bonds": 0, "murcko": None},
+            {"id": "phenol", "rotatable_bonds": 0, "murcko": "c1ccccc1"}])
+
     # Benzene has a polar surface area of zero.
     def test_tpsa_0(self):
         self.assertEqual(tpsa("c1ccccc1"), 0)
@@ -86,6 +771,29 @@ class violetTests(unittest.TestCase):
     def test_tpsa_57(self):
         self.assertEqual(round(tpsa("OC(=O)C1(O)CC1"), 2), 57.53)
 
+    # A calculator can be reused for many molecules, given as SMILES strings
+    # or Indigo objects, without modifying them.
+    def test_tpsa_calculator_many(self):
+        calculator = TPSACalculator()
+        mol = calculator.indigo.loadMolecule("c1ccncc1")
+        before = mol.canonicalSmiles()
+        results = list(calculator.compute_many(["c1ccccc1", mol, "OC(=O)C1(O)CC1"]))
+        self.assertEqual([round(r, 2) for r in results], [0, 12.89, 57.53])
+        self.assertEqual(mol.canonicalSmiles(), before)
+
+    # A custom table only counts the patterns it contains.
+    def test_tpsa_calculator_custom_table(self):
+        fd, fn = tempfile.mkstemp(suffix=".tab")
+        with os.fdopen(fd, "w") as table:
+            table.write("psa\tSMARTS\tdescription\n")
+            table.write("20.23\t[O+0;H1;D1]\t[OH]-\n")
+        try:
+            calculator = TPSACalculator(table=fn)
+            mol = calculator.indigo.loadMolecule("OC(=O)C1(O)CC1")
+            self.assertEqual(round(calculator.compute(mol), 2), 40.46)
+        finally:
+            os.remove(fn)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -15,9 +15,40 @@
 import collections
 import logging
 import os
+import weakref
 
 # Third-party module imports
-import indigo as indigo_module
+from indigo import IndigoException
+
+# Violet library imports
+from violet import instrument
+from violet.failures import from_exception, tag
+from violet.session import resolve_session
+
+
+# The default pattern table, relative to this file.
+DEFAULT_TABLE = os.path.join(os.path.dirname(__file__), 'data', 'tpsa.tab')
+
+Pattern = collections.namedtuple("Pattern", ["value", "smarts", "subsearch"])
+
+
+def load_table(fn=DEFAULT_TABLE):
+    """
+    Read a TPSA pattern table and return a list of (value, smarts) tuples.
+    The table is tab separated, with a header line and the columns
+    contribution, SMARTS and description.
+    """
+    rows = []
+    with open(fn) as table:
+        # Ignore the header line
+        next(table)
+        for line in table:
+            if not line.strip():
+                continue
+            # Extract the fields
+            value, smarts = line.rstrip("\n").split("\t")[:2]
+            rows.append((float(value), smarts))
+    return rows
 
 
 def tpsa_count_matches(indigo, subsearch, mol_obj):
@@ -28,42 +59,111 @@ def tpsa_count_matches(indigo, subsearch, mol_obj):
     return matcher.countMatches(subsearch)
 
 
-def tpsa(smiles):
+class TPSACalculator(object):
+    """
+    Compute topological polar surface areas using a pattern table that is
+    read and compiled once, when the calculator is created.
+
+    Molecules passed to compute() must belong to the same Indigo session as
+    the calculator, which is available as the indigo attribute. indigo can
+    be a session or the name of a session profile; by default the session
+    of the default profile for this thread is used.
+    """
+
+    def __init__(self, indigo=None, table=DEFAULT_TABLE):
+        indigo = resolve_session(indigo)
+        self.indigo = indigo
+        self.table = table
+        self.patterns = [Pattern(value, smarts, indigo.loadSmarts(smarts))
+                         for value, smarts in load_table(table)]
+
+    def compute(self, mol):
+        """
+        Return the TPSA of an Indigo molecule. The molecule is not modified.
+        """
+        mol = mol.clone()
+        # Molecules MUST be dearomatized for this TPSA calculation to work correctly.
+        with instrument.stage('dearomatize'):
+            mol.dearomatize()
+        return self.compute_dearomatized(mol)
+
+    def compute_dearomatized(self, mol):
+        """
+        Return the TPSA of an Indigo molecule that has already been
+        dearomatized.
+        """
+        with instrument.stage('match'):
+            matcher = self.indigo.substructureMatcher(mol)
+            return sum(matcher.countMatches(pattern.subsearch)*pattern.value for pattern in self.patterns)
+
+    def compute_many(self, molecules, failures=None):
+        """
+        Generate the TPSA of each item in an iterable of Indigo molecules or
+        SMILES strings. Items that can't be processed yield False, as tpsa()
+        does, and are added to failures, a list or
+        violet.failures.FailureLog, if one is given. Nothing is logged.
+        """
+        for index, mol in enumerate(molecules):
+            instrument.count('molecules')
+            smiles = mol if isinstance(mol, str) else None
+            try:
+                if smiles is not None:
+                    with instrument.stage('parse'):
+                        try:
+                            mol = self.indigo.loadMolecule(smiles)
+                        except IndigoException as e:
+                            raise tag(e, 'parse')
+                yield self.compute(mol)
+            except IndigoException as e:
+                instrument.count('failures')
+                if failures is not None:
+                    failures.append(from_exception(index, index, smiles, e, 'tpsa'))
+                yield False
+
+
+# The calculator for each Indigo session, created on first use.
+_calculators = weakref.WeakKeyDictionary()
+
+
+def default_calculator(indigo=None):
+    """
+    Return the cached TPSACalculator for an Indigo session, or the name of a
+    session profile, creating it if necessary. Without a session, the
+    calculator for the default session of this thread is returned.
+    """
+    indigo = resolve_session(indigo)
+    if indigo not in _calculators:
+        _calculators[indigo] = TPSACalculator(indigo)
+    return _calculators[indigo]
+
+
+def tpsa(smiles, session=None):
     """
     Compute the topological polar surface area of a molecule specified as a
-    SMILES string.
+    SMILES string. session is an Indigo session or the name of a session
+    profile; by default the session of the default profile for this thread
+    is reused.
     """
 
     return_value = False
 
-    # Variables to store the pattern defintions
-    Pattern = collections.namedtuple("Pattern", ["value", "subsearch"])
-    patterns = []
-
     try:
-        # Initialise the Indigo library
-        indigo = indigo_module.Indigo()
-        # Build the path to the tpsa data file, relative to this file.
-        fn = os.path.join(os.path.dirname(__file__), 'data/tpsa.tab')
-        # Get the patterns from the tpsa.tab file, ignoring the header line
-        for line in open(fn).readlines()[1:]:
-            # Extract the fields
-            value, smarts, comment = line.split("\t")
-            subsearch = indigo.loadSmarts(smarts)
-            # Store for later use
-            patterns.append(Pattern(float(value), subsearch))
-
+        instrument.count('molecules')
+        calculator = default_calculator(session)
         # Load the molecule
-        mol = indigo.loadMolecule(smiles)
+        with instrument.stage('parse'):
+            mol = calculator.indigo.loadMolecule(smiles)
         # Molecules MUST be dearomatized for this TPSA calculation to work correctly.
-        mol.dearomatize()
-        return_value = sum(tpsa_count_matches(indigo, pattern.subsearch, mol)*pattern.value for pattern in patterns)
+        with instrument.stage('dearomatize'):
+            mol.dearomatize()
+        return_value = calculator.compute_dearomatized(mol)
 
     except IndigoException as e:
+        instrument.count('failures')
         logging.error("Indigo exception: %s" % (e))
     except Exception as e:
+        instrument.count('failures')
         logging.error("Exception: %s" % (e))
     finally:
         return return_value
 
-